@@ -5,8 +5,22 @@
 # -c mosquitto client id
 # -u mosquitto client user id
 # -p mosquitto client password
-# -s mosquitto server (dns or ip address)
+# -s mosquitto server (dns or ip address) and optional port (default 1883)
 # -t mosquitto MQTT topic to publish to
+# -q QoS level of published messages (0 or 1, default 0), QoS 1 messages are published
+#    without waiting and are saved in the -k file if they aren't acknowledged within 10 seconds,
+#    so a message may be published more than once
+# -b maximum number of messages waiting to be published (default 1000)
+# -k file to hold messages while the server is unavailable
+# -f publish each device to its own topic (<topic>/inverters/<ID>, <topic>/optimizers/<ID>)
+#    only when its values change
+# -d per field change thresholds for -f (e.g. Pac=5,Vmod=0.5, default: any change)
+# -i minimum interval in seconds between messages on each device topic (default 0), a change
+#    that arrives within the interval is published when it expires
+# -r publish retained messages
+# -G report memory use every n seconds and when SIGUSR1 is received (0 = only on SIGUSR1)
+# -X soft memory cap (e.g. 50M), devices that haven't been seen for a day are forgotten when
+#    it is exceeded
 #
 #example:
 #
@@ -22,51 +36,331 @@ import json
 import getopt
 import time
 import sys
+import os
+import threading
+import Queue
+import signal
 import paho.mqtt.client as mqtt
+from seMemory import *
 
 # state values
 stateDict = {"inverters": {}, "optimizers": {}}
 
+# connection parameters
+clientid = ""
+user = ""
+passwd = None
+server = "localhost"
+port = 1883
+topic = ""
+qos = 0
+queueSize = 1000
+spillFileName = ""
+minReconnectDelay = 1
+maxReconnectDelay = 120
+publishTimeout = 10
+fanOut = False
+thresholds = {}
+minInterval = 0
+retain = False
+spillInterval = 5
+
+# publishing state
+connected = threading.Event()
+pubQueue = None
+dropped = 0
+nextDrain = 0       # time the spill file can be sent again after a failure
+lastPublished = {}  # topic: (time, device values)
+pendingDevices = {} # topic: device values waiting for the minimum interval
+pendingLock = threading.Lock()
+pendingInterval = .1
+lastSeen = {}       # (device type, device ID): time
+outstanding = {}    # message ID: (time, topic, payload, retain) of QoS 1 messages waiting for acks
+earlyAcks = set()   # message IDs that were acknowledged before they were added to outstanding
+outstandingLock = threading.Lock()
+memReportInterval = None
+memCapSize = 0
+
+# MQTT connection callbacks
+def onConnect(client, userdata, flags, rc):
+    if rc == 0:
+        # the client library sends the messages that weren't acknowledged again, so their
+        # timeouts start again
+        with outstandingLock:
+            now = time.time()
+            for (mid, (sendTime, msgTopic, payload, msgRetain)) in outstanding.items():
+                outstanding[mid] = (now, msgTopic, payload, msgRetain)
+        connected.set()
+    else:
+        print "MQTT connection refused: " + mqtt.connack_string(rc)
+
+def onDisconnect(client, userdata, rc):
+    connected.clear()
+
+def onPublish(client, userdata, mid):
+    if qos > 0:
+        with outstandingLock:
+            if outstanding.pop(mid, None) is None:
+                earlyAcks.add(mid)
+
+# save a message while the server is unavailable
+def spillMsg(msgTopic, payload, msgRetain):
+    with open(spillFileName, "a") as spillFile:
+        spillFile.write(json.dumps([msgTopic, payload, msgRetain])+"\n")
+
+# publish the messages that were saved while the server was unavailable
+# the file is only read when the server is connected, and not again for an interval if
+# sending fails, so that messages are only appended to it while the server is unavailable
+def publishSpill():
+    global nextDrain
+    if not (connected.is_set() and (time.time() >= nextDrain)):
+        return False
+    if not os.path.exists(spillFileName):
+        return True
+    with open(spillFileName) as spillFile:
+        spillMsgs = [json.loads(line) for line in spillFile if line.strip() != ""]
+    for i in range(len(spillMsgs)):
+        if not publishMsg(*spillMsgs[i]):
+            # keep the messages that weren't sent
+            with open(spillFileName, "w") as spillFile:
+                for msg in spillMsgs[i:]:
+                    spillFile.write(json.dumps(msg)+"\n")
+            nextDrain = time.time() + spillInterval
+            return False
+    os.remove(spillFileName)
+    return True
+
+# publish a message without waiting for it to be acknowledged
+def publishMsg(msgTopic, payload, msgRetain=False):
+    if not connected.is_set():
+        return False
+    try:
+        info = mqttc.publish(msgTopic, payload, qos, msgRetain)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            return False
+        if qos > 0:
+            # the ack is handled by onPublish
+            with outstandingLock:
+                if info.mid in earlyAcks:
+                    earlyAcks.remove(info.mid)
+                else:
+                    outstanding[info.mid] = (time.time(), msgTopic, payload, msgRetain)
+        return True
+    except Exception as ex:
+        print "MQTT Exception: " + str(ex)
+        return False
+
+# save the QoS 1 messages that haven't been acknowledged within the timeout while connected
+# without a spill file they are left to the client library, which sends them again when it
+# reconnects
+def expireOutstanding():
+    if not connected.is_set():
+        return
+    expireTime = time.time() - publishTimeout
+    with outstandingLock:
+        expired = sorted((sendTime, mid) for (mid, (sendTime, msgTopic, payload, msgRetain)) in outstanding.items()
+                         if sendTime < expireTime)
+        expiredMsgs = [outstanding.pop(mid)[1:] for (sendTime, mid) in expired]
+    if spillFileName != "":
+        for expiredMsg in expiredMsgs:
+            spillMsg(*expiredMsg)
+
+# publish queued messages
+def publishQueue():
+    while True:
+        expireOutstanding()
+        try:
+            (msgTopic, payload, msgRetain) = pubQueue.get(True, spillInterval)
+        except Queue.Empty:
+            # send saved messages when the connection comes back
+            if spillFileName != "":
+                publishSpill()
+            continue
+        if spillFileName != "":
+            # keep messages in order by sending any saved messages first
+            if not (publishSpill() and publishMsg(msgTopic, payload, msgRetain)):
+                spillMsg(msgTopic, payload, msgRetain)
+        else:
+            # hold the message until the connection comes back
+            while not publishMsg(msgTopic, payload, msgRetain):
+                connected.wait(maxReconnectDelay)
+                time.sleep(minReconnectDelay)
+
+# add a message to the publish queue, discarding the oldest message if it is full
+def queueMsg(msgTopic, payload, msgRetain=False):
+    global dropped
+    while True:
+        try:
+            pubQueue.put_nowait((msgTopic, payload, msgRetain))
+            return
+        except Queue.Full:
+            try:
+                pubQueue.get_nowait()
+                dropped += 1
+                print "MQTT queue full, dropped %d messages" % dropped
+            except Queue.Empty:
+                pass
+
+# return True if any device value changed by more than its threshold
+def devChanged(lastDict, devDict):
+    for item in devDict.keys():
+        if item in ["Date", "Time"]:
+            continue
+        try:
+            if abs(devDict[item] - lastDict[item]) > thresholds.get(item, 0):
+                return True
+        except KeyError:
+            return True
+        except TypeError:   # not a number
+            if devDict[item] != lastDict[item]:
+                return True
+    return False
+
+# publish the values of a device to its topic
+def publishDevice(devTopic, devDict, now):
+    lastPublished[devTopic] = (now, dict(devDict))
+    queueMsg(devTopic, json.dumps(devDict), retain)
+
+# publish devices whose values have changed to their own topics
+# changes within the minimum interval are held until the interval expires
+def publishDevices(devType, devices):
+    now = time.time()
+    with pendingLock:
+        for seId in devices.keys():
+            devTopic = topic+"/"+devType+"/"+seId
+            devDict = devices[seId]
+            try:
+                (lastTime, lastDict) = lastPublished[devTopic]
+                if not devChanged(lastDict, devDict):
+                    pendingDevices.pop(devTopic, None)
+                    continue
+                if now - lastTime < minInterval:
+                    pendingDevices[devTopic] = dict(devDict)
+                    continue
+            except KeyError:
+                pass
+            pendingDevices.pop(devTopic, None)
+            publishDevice(devTopic, devDict, now)
+
+# publish the held changes when their minimum interval expires
+# this runs in a thread because the input may not be read again until the next post
+def publishPending():
+    while True:
+        time.sleep(pendingInterval)
+        now = time.time()
+        with pendingLock:
+            for devTopic in pendingDevices.keys():
+                if now - lastPublished[devTopic][0] >= minInterval:
+                    publishDevice(devTopic, pendingDevices.pop(devTopic), now)
+
+# remove the devices that haven't been seen since a time from the state
+def evictDevices(before):
+    evicted = evictStale(stateDict, lastSeen, before)
+    with pendingLock:
+        for (devType, seId) in evicted:
+            lastPublished.pop(topic+"/"+devType+"/"+seId, None)
+            pendingDevices.pop(topic+"/"+devType+"/"+seId, None)
+    return len(evicted)
+
 # get program arguments and options
-(opts, args) = getopt.getopt(sys.argv[1:], "c:u:p:s:t:")
+(opts, args) = getopt.getopt(sys.argv[1:], "b:c:d:fG:i:k:p:q:rs:t:u:X:")
 try:
     inFile = open(args[0])
 except:
     inFile = sys.stdin
 for opt in opts:
+    if opt[0] == "-b":
+        queueSize = int(opt[1])
     if opt[0] == "-c":
         clientid = opt[1]
+    if opt[0] == "-d":
+        for threshold in opt[1].split(","):
+            (item, value) = threshold.split("=")
+            thresholds[item] = float(value)
+    if opt[0] == "-f":
+        fanOut = True
+    if opt[0] == "-G":
+        memReportInterval = int(opt[1])
+    if opt[0] == "-i":
+        minInterval = float(opt[1])
+    if opt[0] == "-k":
+        spillFileName = opt[1]
     if opt[0] == "-u":
         user = opt[1]
     if opt[0] == "-p":
         passwd = opt[1]
+    if opt[0] == "-q":
+        qos = int(opt[1])
+    if opt[0] == "-r":
+        retain = True
     if opt[0] == "-s":
-        server = opt[1]
+        serverAddr = opt[1].split(":")
+        server = serverAddr[0]
+        if len(serverAddr) > 1:
+            port = int(serverAddr[1])
     if opt[0] == "-t":
         topic = opt[1]
-        
+    if opt[0] == "-X":
+        try:
+            memCapSize = parseMemSize(opt[1])
+        except ValueError:
+            print "Invalid memory cap size", opt[1]
+            sys.exit(1)
+if (memReportInterval is not None) or memCapSize:
+    startMemory(memReportInterval or 0, memCapSize)
+    signal.signal(signal.SIGUSR1, requestMemory)
+
+# start a persistent connection with the network loop running in the background
+mqttc = mqtt.Client(client_id=clientid)
+if user != "":
+    mqttc.username_pw_set(user, passwd)
+mqttc.on_connect = onConnect
+mqttc.on_disconnect = onDisconnect
+mqttc.on_publish = onPublish
+# the messages waiting for acks are limited by the publish queue size
+mqttc.max_inflight_messages_set(queueSize)
+mqttc.reconnect_delay_set(minReconnectDelay, maxReconnectDelay)
+mqttc.connect_async(server, port)
+mqttc.loop_start()
+pubQueue = Queue.Queue(queueSize)
+pubThread = threading.Thread(name="publish thread", target=publishQueue)
+pubThread.daemon = True
+pubThread.start()
+if fanOut and minInterval:
+    pendingThread = threading.Thread(name="pending thread", target=publishPending)
+    pendingThread.daemon = True
+    pendingThread.start()
+
 # read the input forever
 while True:
-    jsonStr = ""
+    for line in checkMemory(evictDevices):
+        print line
+    jsonStr = inFile.readline()
     # wait for data
     while jsonStr == "":
         time.sleep(.1)
+        for line in checkMemory(evictDevices):
+            print line
         jsonStr = inFile.readline()
     inDict = json.loads(jsonStr)
     # update the state values
     stateDict["inverters"].update(inDict["inverters"])
     stateDict["optimizers"].update(inDict["optimizers"])
+    now = time.time()
+    for devType in ["inverters", "optimizers"]:
+        for seId in inDict[devType].keys():
+            lastSeen[(devType, seId)] = now
     # zero current energy and power when an event occurs
     if len(inDict["events"]) != 0:
         for inverter in stateDict["inverters"].keys():
             stateDict["inverters"][inverter]["Eac"] = 0.0
             stateDict["inverters"][inverter]["Pac"] = 0.0
     # send to MQTT
-    try:
-        mqttc = mqtt.Client(client_id=clientid)
-        mqttc.username_pw_set(user, passwd)
-        mqttc.connect(server)
-        mqttc.publish(topic, json.dumps(stateDict))
-        mqttc.disconnect()
-    except Exception as ex:
-         print "MQTT Exception: " + str(ex)
+    if fanOut:
+        if len(inDict["events"]) != 0:
+            publishDevices("inverters", stateDict["inverters"])
+        else:
+            publishDevices("inverters", inDict["inverters"])
+        publishDevices("optimizers", inDict["optimizers"])
+    else:
+        queueMsg(topic, json.dumps(stateDict), retain)
@@ -0,0 +1,245 @@
+#!/usr/bin/python
+
+# Convert SolarEdge inverter performance monitoring data to columnar files for analysis
+#
+# If pyarrow is available, the data of each day for each device type is written to a
+# Parquet file for the day.  Otherwise, each column of each day is written to a numpy .npy
+# file in a directory for the day.  Rows are sorted by device ID and time so the data for
+# a single device can be sliced out of each day without reading the other devices.  Late
+# data for a day that was already written is merged into the files of the day.  A day that
+# is written by a later run replaces the files of the day in the output directory.
+
+import getopt
+import json
+import os
+import sys
+import time
+
+from seDataParams import *
+from seCompress import *
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# file parameters
+outDir = "."
+outFormat = ""
+csvType = ""
+delim = ","
+maxOpenDays = 2
+
+# device data items and output formats for each device type
+devItems = {"inverters": (invItems, invOutFmt), "optimizers": (optItems, optOutFmt)}
+
+# rows of each day that have not been written yet
+dayRows = {"inverters": {}, "optimizers": {}}
+# days that have been written
+writtenDays = {"inverters": set(), "optimizers": set()}
+# cached time stamps
+timeStamps = {}
+
+# column names and types of a device type
+def devColumns(devType):
+    (items, fmts) = devItems[devType]
+    columns = [("time", "int64")]
+    for i in range(2, len(items)):
+        if fmts[i] == "%s":     # device IDs
+            columns.append((items[i], "uint32"))
+        elif fmts[i] == "%d":
+            columns.append((items[i], "int64"))
+        else:
+            columns.append((items[i], "float64"))
+    return columns
+
+# convert a date and time to seconds since the epoch
+def epochTime(dateStr, timeStr):
+    try:
+        return timeStamps[(dateStr, timeStr)]
+    except KeyError:
+        timeStamp = int(time.mktime(time.strptime(dateStr+" "+timeStr, "%Y-%m-%d %H:%M:%S")))
+        timeStamps[(dateStr, timeStr)] = timeStamp
+        return timeStamp
+
+# convert a device dictionary to a row of column values
+def devRow(devType, devDict):
+    (items, fmts) = devItems[devType]
+    row = [epochTime(devDict["Date"], devDict["Time"])]
+    for i in range(2, len(items)):
+        if fmts[i] == "%s":
+            row.append(int(str(devDict[items[i]]), 16))
+        else:
+            row.append(devDict[items[i]])
+    return row
+
+# add a row of device data to its day
+def addRow(devType, dateStr, row):
+    days = dayRows[devType]
+    days.setdefault(dateStr, []).append(row)
+    if len(days) > maxOpenDays:
+        writeDay(devType, min(days.keys()))
+
+# write the rows of a day as columns
+def writeDay(devType, dateStr):
+    rows = dayRows[devType].pop(dateStr)
+    # sort by device ID then time
+    rows.sort(key=lambda row: (row[1], row[0]))
+    columns = devColumns(devType)
+    colValues = zip(*rows)
+    if outFormat == "parquet":
+        writeParquet(devType, dateStr, columns, colValues)
+    else:
+        writeNpy(devType, dateStr, columns, colValues)
+    writtenDays[devType].add(dateStr)
+    timeStamps.clear()
+
+# write the columns of a day to a parquet file
+def writeParquet(devType, dateStr, columns, colValues):
+    devDir = os.path.join(outDir, devType)
+    pqFileName = os.path.join(devDir, dateStr+".parquet")
+    if dateStr in writtenDays[devType]:
+        # late data for a day that was already written
+        oldTable = pyarrow.parquet.read_table(pqFileName)
+        colValues = [oldTable.column(columns[i][0]).to_pylist() + list(colValues[i]) for i in range(len(columns))]
+        order = sorted(range(len(colValues[0])), key=lambda row: (colValues[1][row], colValues[0][row]))
+        colValues = [[values[row] for row in order] for values in colValues]
+    elif not os.path.isdir(devDir):
+        os.makedirs(devDir)
+    pyarrow.parquet.write_table(parquetTable(columns, colValues), pqFileName)
+
+# make a pyarrow table from columns of values
+def parquetTable(columns, colValues):
+    arrays = [pyarrow.array(colValues[i], type=getattr(pyarrow, columns[i][1])()) for i in range(len(columns))]
+    return pyarrow.Table.from_arrays(arrays, [column[0] for column in columns])
+
+# write the columns of a day to .npy files
+def writeNpy(devType, dateStr, columns, colValues):
+    dayDir = os.path.join(outDir, devType, dateStr)
+    arrays = [numpy.array(colValues[i], dtype=columns[i][1]) for i in range(len(columns))]
+    if dateStr in writtenDays[devType]:
+        # late data for a day that was already written
+        oldArrays = [numpy.load(os.path.join(dayDir, column[0]+".npy")) for column in columns]
+        arrays = [numpy.concatenate((oldArrays[i], arrays[i])) for i in range(len(columns))]
+        order = numpy.lexsort((arrays[0], arrays[1]))
+        arrays = [array[order] for array in arrays]
+    elif not os.path.isdir(dayDir):
+        os.makedirs(dayDir)
+    for i in range(len(columns)):
+        numpy.save(os.path.join(dayDir, columns[i][0]+".npy"), arrays[i])
+
+# write all remaining data and close the files
+def closeOutput():
+    for devType in dayRows.keys():
+        for dateStr in sorted(dayRows[devType].keys()):
+            writeDay(devType, dateStr)
+
+# read performance data in JSON format
+def readJson(inFile):
+    for jsonStr in inFile:
+        if jsonStr.strip() == "":
+            continue
+        msgDict = json.loads(jsonStr)
+        for devType in devItems.keys():
+            for devDict in msgDict[devType].values():
+                addRow(devType, devDict["Date"], devRow(devType, devDict))
+
+# read device data in CSV format written by se2csv
+def readCsv(inFile, devType):
+    (items, fmts) = devItems[devType]
+    for line in inFile:
+        values = line.rstrip("\n").split(delim)
+        if values == items:    # header
+            continue
+        devDict = {}
+        for i in range(len(items)):
+            if fmts[i] == "%s":
+                devDict[items[i]] = values[i]
+            elif fmts[i] == "%d":
+                devDict[items[i]] = int(values[i])
+            else:
+                devDict[items[i]] = float(values[i])
+        addRow(devType, devDict["Date"], devRow(devType, devDict))
+
+# load the data for a single device between two dates (YYYY-MM-DD, inclusive)
+# returns a dictionary of numpy arrays or a pyarrow table
+def loadDevice(outDir, devType, seId, startDate="", endDate="9999-99-99"):
+    devId = int(seId, 16)
+    devDir = os.path.join(outDir, devType)
+    dayNames = sorted(os.listdir(devDir))
+    if any(dayName.endswith(".parquet") for dayName in dayNames):
+        tables = []
+        for dayName in dayNames:
+            dateStr = dayName[:-len(".parquet")]
+            if (not dayName.endswith(".parquet")) or (dateStr < startDate) or (dateStr > endDate):
+                continue
+            table = pyarrow.parquet.read_table(os.path.join(devDir, dayName))
+            ids = numpy.concatenate([chunk.to_numpy() for chunk in table.column("ID").chunks])
+            (first, last) = (numpy.searchsorted(ids, devId, "left"), numpy.searchsorted(ids, devId, "right"))
+            tables.append(table.slice(first, last-first))
+        if tables == []:
+            columns = devColumns(devType)
+            return parquetTable(columns, [[]]*len(columns))
+        return pyarrow.concat_tables(tables)
+    columns = [column[0] for column in devColumns(devType)]
+    slices = dict((column, []) for column in columns)
+    for dateStr in dayNames:
+        if (dateStr < startDate) or (dateStr > endDate):
+            continue
+        dayDir = os.path.join(devDir, dateStr)
+        # memory map the columns so only the rows for the device are read
+        ids = numpy.load(os.path.join(dayDir, "ID.npy"), mmap_mode="r")
+        (first, last) = (numpy.searchsorted(ids, devId, "left"), numpy.searchsorted(ids, devId, "right"))
+        if first == last:
+            continue
+        for column in columns:
+            slices[column].append(numpy.load(os.path.join(dayDir, column+".npy"), mmap_mode="r")[first:last])
+    return dict((column, numpy.concatenate(slices[column]) if slices[column] != [] else numpy.array([]))
+                for column in columns)
+
+if __name__ == "__main__":
+    # get program arguments and options
+    (opts, args) = getopt.getopt(sys.argv[1:], "c:d:f:o:")
+    for opt in opts:
+        if opt[0] == "-c":
+            csvType = opt[1]
+        elif opt[0] == "-d":
+            delim = opt[1]
+        elif opt[0] == "-f":
+            outFormat = opt[1]
+        elif opt[0] == "-o":
+            outDir = opt[1]
+    if csvType not in ["", "inverters", "optimizers"]:
+        print "Invalid CSV device type", csvType
+        sys.exit(1)
+    # use parquet if it is available
+    if outFormat == "":
+        outFormat = "parquet" if pyarrow else "npy"
+    if (outFormat == "parquet") and not pyarrow:
+        print "pyarrow is required to write Parquet files"
+        sys.exit(1)
+    if (outFormat == "npy") and not numpy:
+        print "numpy is required to write .npy files"
+        sys.exit(1)
+    if outFormat not in ["parquet", "npy"]:
+        print "Invalid output format", outFormat
+        sys.exit(1)
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    # process the data
+    for inFileName in args or ["stdin"]:
+        if inFileName == "stdin":
+            inFile = sys.stdin
+        else:
+            inFile = openCompressed(inFileName)
+        if csvType != "":
+            readCsv(inFile, csvType)
+        else:
+            readJson(inFile)
+        inFile.close()
+    closeOutput()
@@ -4,9 +4,13 @@
 
 import getopt
 import json
+import multiprocessing
+import operator
+import os
 import sys
 
 from seDataParams import *
+from seCompress import *
 
 # file parameters
 inFileName = ""
@@ -15,14 +19,23 @@ optFileName = ""
 headers = False
 delim = ","
 writeMode = "w"
-invSeq = 0
-optSeq = 0
+partition = []
+bufSize = 1024*1024
+flushRows = 100000
+jobs = 1
+chunkSize = 16*1024*1024
+
+# output state
+outBufs = {}        # rows waiting to be written to each output file
+outFiles = set()    # output files that have been opened
+bufRows = 0
+devItems = {"inverters": invItems, "optimizers": optItems}
 
 def openInFile(inFileName):
     if inFileName == "stdin":
         return sys.stdin
     else:
-        return open(inFileName)
+        return openCompressed(inFileName)
 
 # open the specified input file
 def openInput(inFileName):
@@ -32,57 +45,115 @@ def openInput(inFileName):
 def closeInput(dataFile):
     dataFile.close()
 
-# open in output file if it is specified
-def openOutFile(fileName, writeMode="w"):
-    if fileName != "":
-        return open(fileName, writeMode)
-
-# open the output files
-def openOutFiles(invFileName, optFileName):
-    invFile = openOutFile(invFileName, writeMode)
-    optFile = openOutFile(optFileName, writeMode)
-    return (invFile, optFile)
-    
-# close output files        
-def closeOutFiles(invFile, optFile):
-    if invFile:
-        invFile.close()
-    if optFile:
-        optFile.close()
+# compile a function that formats a device dictionary as an output row
+def rowFormatter(outFmt, devItems):
+    rowFmt = delim.replace("%", "%%").join(outFmt)+"\n"
+    getItems = operator.itemgetter(*devItems)
+    return lambda devDict: rowFmt % getItems(devDict)
+
+# name of the output file for a device, partitioned by day and/or device ID
+def partFileName(fileName, devDict):
+    if partition == []:
+        return fileName
+    (base, ext) = os.path.splitext(fileName)
+    return base+"".join("-"+devDict[item] for item in partition)+ext
+
+# format the data in a message as rows for each output file
+def formatData(msgDict, bufs):
+    rows = 0
+    for (fileName, devType, formatRow) in outputs:
+        for devDict in msgDict[devType].values():
+            fileRows = bufs.setdefault((partFileName(fileName, devDict), devType), [])
+            fileRows.append(formatRow(devDict))
+            rows += 1
+    return rows
+
+# write buffered rows to the output files
+# each file is opened with the write mode the first time it is written in a run, so that the
+# partitions of a previous run are replaced unless appending was requested, and appended to
+# after that
+def writeBufs(bufs):
+    for (fileName, devType) in sorted(bufs.keys()):
+        if fileName in outFiles:
+            mode = "a"
+        else:
+            mode = writeMode
+            outFiles.add(fileName)
+        with open(fileName, mode, bufSize) as outFile:
+            if headers and (outFile.tell() == 0):
+                writeHeaders(outFile, devItems[devType])
+            outFile.write("".join(bufs[(fileName, devType)]))
 
 # write output file headers
 def writeHeaders(outFile, items):
     outFile.write(delim.join(item for item in items)+"\n")
 
 # write data to output files
-def writeData(msgDict, invFile, optFile):
-    global invSeq, optSeq
-    if invFile:
-        if headers and (invSeq == 0) and (msgDict["inverters"] != {}):
-            writeHeaders(invFile, invItems)
-        for seId in msgDict["inverters"].keys():
-            invSeq = writeDevData(invFile, invOutFmt, msgDict["inverters"][seId], invItems, invSeq)
-    if optFile:
-        if headers and (optSeq == 0) and (msgDict["optimizers"] != {}):
-            writeHeaders(optFile, optItems)
-        for seId in msgDict["optimizers"].keys():
-            optSeq = writeDevData(optFile, optOutFmt, msgDict["optimizers"][seId], optItems, optSeq)
-
-# write device data to output file
-def writeDevData(outFile, outFmt, devDict, devItems, devSeq):
-    if outFile:
-        outMsg = delim.join([(outFmt[i] % devDict[devItems[i]]) for i in range(len(devItems))])
-        devSeq += 1
-        outFile.write(outMsg+"\n")
-    return devSeq
+def writeData(msgDict):
+    global bufRows
+    bufRows += formatData(msgDict, outBufs)
+    if bufRows >= flushRows:
+        flushData()
+
+# write all buffered data
+def flushData():
+    global bufRows
+    writeBufs(outBufs)
+    outBufs.clear()
+    bufRows = 0
+
+# divide the input files into chunks of lines in input order
+def listChunks(inFiles):
+    chunks = []
+    for inFileName in inFiles:
+        if compressMethod(inFileName) != "":
+            # compressed files can't be divided
+            chunks.append((inFileName, 0, -1))
+            continue
+        fileSize = os.path.getsize(inFileName)
+        for start in range(0, max(fileSize, 1), chunkSize):
+            chunks.append((inFileName, start, min(start+chunkSize, fileSize)))
+    return chunks
+
+# convert the lines that start within a chunk of an input file
+def convertChunk(chunk):
+    (inFileName, start, end) = chunk
+    bufs = {}
+    with openCompressed(inFileName) as inFile:
+        if end < 0:
+            # whole file
+            for jsonStr in inFile:
+                if jsonStr.strip() != "":
+                    formatData(json.loads(jsonStr), bufs)
+            return bufs
+        if start > 0:
+            # skip the line that started in the previous chunk
+            inFile.seek(start-1)
+            inFile.readline()
+        filePtr = inFile.tell()
+        while filePtr < end:
+            jsonStr = inFile.readline()
+            if jsonStr == "":
+                break
+            filePtr += len(jsonStr)
+            if jsonStr.strip() != "":
+                formatData(json.loads(jsonStr), bufs)
+    return bufs
+
+# convert the input files using a pool of processes and write the results in input order
+def convertFiles(inFiles):
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for bufs in pool.imap(convertChunk, listChunks(inFiles)):
+            writeBufs(bufs)
+    finally:
+        pool.close()
+        pool.join()
 
 # get program arguments and options
-(opts, args) = getopt.getopt(sys.argv[1:], "ad:hi:o:")
+(opts, args) = getopt.getopt(sys.argv[1:], "ad:hi:j:o:p:")
 
-try:
-    inFileName = args[0]
-except:
-    inFileName = "stdin"
+inFiles = listDataFiles(args)
 for opt in opts:
     if opt[0] == "-a":
         writeMode = "a"
@@ -92,15 +163,34 @@ for opt in opts:
         headers = True
     elif opt[0] == "-i":
         invFileName = opt[1]
+    elif opt[0] == "-j":
+        jobs = int(opt[1])
     elif opt[0] == "-o":
         optFileName = opt[1]
+    elif opt[0] == "-p":
+        for part in opt[1].split(","):
+            if part == "day":
+                partition.append("Date")
+            elif part == "id":
+                partition.append("ID")
+            else:
+                print "Invalid partition", part
+                sys.exit(1)
+
+# output files and row formatters for each device type
+outputs = []
+if invFileName != "":
+    outputs.append((invFileName, "inverters", rowFormatter(invOutFmt, invItems)))
+if optFileName != "":
+    outputs.append((optFileName, "optimizers", rowFormatter(optOutFmt, optItems)))
 
 # process the data
-inFile = openInput(inFileName)
-(invFile, optFile) = openOutFiles(invFileName, optFileName)
-for jsonStr in inFile:
-    writeData(json.loads(jsonStr), invFile, optFile)
-closeInput(inFile)
-closeOutFiles(invFile, optFile)
-    
-
+if (jobs > 1) and (inFiles != []):
+    convertFiles(inFiles)
+else:
+    for inFileName in inFiles or ["stdin"]:
+        inFile = openInput(inFileName)
+        for jsonStr in inFile:
+            writeData(json.loads(jsonStr))
+        closeInput(inFile)
+    flushData()
@@ -0,0 +1,233 @@
+#!/usr/bin/python
+
+# Maintain 5 minute, hourly, and daily rollups of SolarEdge performance data
+#
+# For each device and bucket the count of records and the sum, minimum, maximum, and last
+# value of each numeric data item are accumulated as the data is read.  A bucket is written
+# to the database as one row when the latest time seen for the device passes the end of the
+# bucket plus the allowed lateness.  Data that arrives for a bucket that has already been
+# written is accumulated in a new bucket that is merged with the stored values when it is
+# written.  Each row also contains the times of the records that have been added to it, and
+# a record whose time is already in its bucket is skipped, so replaying a file or reading
+# overlapping files doesn't count the same data twice.
+
+import getopt
+import json
+import sqlite3
+import sys
+import time
+
+from seDataParams import *
+from seCompress import *
+
+# file parameters
+dbFileName = ""
+following = False
+lateness = 60
+sleepInterval = .1
+
+# rollup resolutions in seconds, 0 means days
+resolutions = [300, 60*60, 0]
+
+# numeric data items of each device type
+devFields = {"inverters": [invItems[i] for i in range(3, len(invItems)) if invOutFmt[i] != "%s"],
+             "optimizers": [optItems[i] for i in range(3, len(optItems)) if optOutFmt[i] != "%s"]}
+
+# rollup table of each device type
+rollupTables = {"inverters": "invRollups", "optimizers": "optRollups"}
+aggNames = ["sum", "min", "max", "last"]
+
+# open buckets - (res, devType, ID, bucket):
+#   [count, lastTime, [[sum, min, max, last] of each field], times stored in the row, new times]
+buckets = {}
+# bucket keys and latest time seen for each device - (devType, ID): [latest time, set of keys]
+devices = {}
+# cached time stamps
+timeStamps = {}
+dayStarts = {}
+
+# column names of the aggregates of the numeric data items of a device type
+def aggColumns(devType):
+    return [field+"_"+aggName for field in devFields[devType] for aggName in aggNames]
+
+# open the database and create the tables
+# times is a comma separated list of the times of the records in the bucket
+def openDb(dbFileName):
+    db = sqlite3.connect(dbFileName)
+    db.execute("pragma journal_mode=wal")
+    db.execute("pragma synchronous=normal")
+    for devType in sorted(rollupTables.keys()):
+        db.execute("create table if not exists %s (res int, ID text, bucket int, count int, lastTime int, "
+                   "times text, %s, primary key (res, ID, bucket))" %
+                   (rollupTables[devType], ", ".join(column+" float" for column in aggColumns(devType))))
+    db.commit()
+    return db
+
+# return the times of the records that have been written to a bucket
+def storedTimes(db, key):
+    (res, devType, seId, start) = key
+    row = db.execute("select times from %s where res=? and ID=? and bucket=?" % rollupTables[devType],
+                     (res, seId, start)).fetchone()
+    if row is None:
+        return set()
+    return set(int(timeStamp) for timeStamp in row[0].split(","))
+
+# convert a date and time to seconds since the epoch
+def epochTime(dateStr, timeStr):
+    try:
+        return timeStamps[(dateStr, timeStr)]
+    except KeyError:
+        if len(timeStamps) > 100000:
+            timeStamps.clear()
+        timeStamp = int(time.mktime(time.strptime(dateStr+" "+timeStr, "%Y-%m-%d %H:%M:%S")))
+        timeStamps[(dateStr, timeStr)] = timeStamp
+        return timeStamp
+
+# start and end of a bucket
+def bucketRange(res, dateStr, timeStamp):
+    if res == 0:
+        # local day
+        try:
+            (start, end) = dayStarts[dateStr]
+        except KeyError:
+            start = int(time.mktime(time.strptime(dateStr, "%Y-%m-%d")))
+            end = int(time.mktime(time.localtime(start+36*60*60)[:3]+(0, 0, 0, 0, 0, -1)))
+            dayStarts[dateStr] = (start, end)
+        return (start, end)
+    start = timeStamp - timeStamp % res
+    return (start, start+res)
+
+# accumulate the data of a device
+def addDevice(db, devType, devDict):
+    timeStamp = epochTime(devDict["Date"], devDict["Time"])
+    device = devices.setdefault((devType, devDict["ID"]), [timeStamp, set()])
+    device[0] = max(device[0], timeStamp)
+    values = [devDict[field] for field in devFields[devType]]
+    for res in resolutions:
+        (start, end) = bucketRange(res, devDict["Date"], timeStamp)
+        key = (res, devType, devDict["ID"], start)
+        try:
+            bucket = buckets[key]
+        except KeyError:
+            stored = storedTimes(db, key)
+            if timeStamp in stored:
+                continue
+            buckets[key] = [1, timeStamp, [[value, value, value, value] for value in values], stored, set([timeStamp])]
+            device[1].add((key, end))
+            continue
+        # skip a record that is already in the bucket
+        if (timeStamp in bucket[3]) or (timeStamp in bucket[4]):
+            continue
+        bucket[4].add(timeStamp)
+        bucket[0] += 1
+        last = timeStamp >= bucket[1]
+        if last:
+            bucket[1] = timeStamp
+        for (agg, value) in zip(bucket[2], values):
+            agg[0] += value
+            if value < agg[1]: agg[1] = value
+            if value > agg[2]: agg[2] = value
+            if last: agg[3] = value
+
+# accumulate the data in a message and write the buckets that have closed
+def addData(db, msgDict):
+    seIds = []
+    for devType in devFields.keys():
+        for devDict in msgDict[devType].values():
+            addDevice(db, devType, devDict)
+            seIds.append((devType, devDict["ID"]))
+    closed = []
+    for seId in seIds:
+        (latest, keys) = devices[seId]
+        for (key, end) in list(keys):
+            if latest >= end + lateness:
+                keys.remove((key, end))
+                closed.append(key)
+    if closed != []:
+        writeBuckets(db, closed)
+
+# statements that merge a bucket with the stored values and insert a new bucket
+def bucketSql(devType):
+    table = rollupTables[devType]
+    # the expressions in an update use the stored values of the row, including lastTime
+    updates = ", ".join("%s_sum=%s_sum+?, %s_min=min(%s_min, ?), %s_max=max(%s_max, ?), "
+                        "%s_last=case when ?>=lastTime then ? else %s_last end" % ((field,)*8)
+                        for field in devFields[devType])
+    updateSql = ("update %s set count=count+?, lastTime=max(lastTime, ?), times=times||','||?, %s "
+                 "where res=? and ID=? and bucket=?" % (table, updates))
+    insertSql = ("insert into %s (res, ID, bucket, count, lastTime, times, %s) values (%s)" %
+                 (table, ", ".join(aggColumns(devType)), ", ".join("?" for i in range(6+len(aggColumns(devType))))))
+    return (updateSql, insertSql)
+
+mergeSql = dict((devType, bucketSql(devType)) for devType in devFields.keys())
+
+# merge buckets with the stored values
+def writeBuckets(db, keys):
+    with db:
+        for key in keys:
+            (res, devType, seId, start) = key
+            (count, lastTime, aggs, stored, times) = buckets.pop(key)
+            timesStr = ",".join(str(timeStamp) for timeStamp in sorted(times))
+            (updateSql, insertSql) = mergeSql[devType]
+            if stored:
+                db.execute(updateSql, [count, lastTime, timesStr] +
+                           [param for (total, minValue, maxValue, last) in aggs
+                                  for param in (total, minValue, maxValue, lastTime, last)] +
+                           [res, seId, start])
+            else:
+                db.execute(insertSql, [res, seId, start, count, lastTime, timesStr] +
+                           [value for agg in aggs for value in agg])
+
+# write all open buckets
+def flushBuckets(db):
+    writeBuckets(db, buckets.keys())
+    for device in devices.values():
+        device[1].clear()
+
+# return the rollups of a device data item between two times
+# each row contains bucket, count, sum, min, max, last
+def queryRollups(db, res, devType, seId, field, startTime=0, endTime=2**62):
+    if field not in devFields[devType]:
+        raise ValueError("unknown data item "+field)
+    return db.execute("select bucket, count, %s from %s where res=? and ID=? and bucket>=? and bucket<? order by bucket" %
+                      (", ".join(field+"_"+aggName for aggName in aggNames), rollupTables[devType]),
+                      (res, seId, startTime, endTime)).fetchall()
+
+# read performance data, following the file if requested
+def readFile(db, inFile, follow):
+    while True:
+        jsonStr = inFile.readline()
+        if jsonStr == "":
+            if not follow:
+                return
+            time.sleep(sleepInterval)
+        elif jsonStr.strip() != "":
+            addData(db, json.loads(jsonStr))
+
+if __name__ == "__main__":
+    # get program arguments and options
+    (opts, args) = getopt.getopt(sys.argv[1:], "fl:o:")
+    for opt in opts:
+        if opt[0] == "-f":
+            following = True
+        elif opt[0] == "-l":
+            lateness = int(opt[1])
+        elif opt[0] == "-o":
+            dbFileName = opt[1]
+    if dbFileName == "":
+        print "Database file must be specified"
+        sys.exit(1)
+    db = openDb(dbFileName)
+    try:
+        inFiles = args or ["stdin"]
+        for inFileName in inFiles:
+            if inFileName == "stdin":
+                inFile = sys.stdin
+            else:
+                inFile = openCompressed(inFileName)
+            # only the last file is followed
+            readFile(db, inFile, following and (inFileName == inFiles[-1]))
+            inFile.close()
+    finally:
+        flushBuckets(db)
+        db.close()
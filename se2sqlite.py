@@ -0,0 +1,158 @@
+#!/usr/bin/python
+
+# Store SolarEdge inverter performance monitoring data in a SQLite database
+#
+# The tables have the same layout as deprecated/sql/solar.sql.  Rows are inserted
+# in batches that are committed every batchRows rows or batchSecs seconds.  The time
+# is checked by a thread so that the rows are committed while waiting for data from a
+# pipe.  A row that has the same date, time, and ID as an existing row replaces it,
+# so data can be loaded more than once.
+
+import getopt
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from seDataParams import *
+from seCompress import *
+
+# file parameters
+dbFileName = ""
+following = False
+batchRows = 10000
+batchSecs = 5.0
+sleepInterval = .1
+maxVars = 999       # maximum number of parameters in a SQLite statement
+
+# table columns in the order of the invItems and optItems data items
+invColumns = ["Date", "Time", "ID", "Uptime", "Intrvl", "Temp", "Eday", "Eint", "Vac",
+              "Iac", "Freq", "Vdc", "Etot", "Pmax", "Pac"]
+invTypes = ["date", "time", "char(8)", "int", "int", "float", "float", "float", "float",
+            "float", "float", "float", "float", "float", "float"]
+optColumns = ["Date", "Time", "ID", "Inv", "Uptime", "Vmod", "Vopt", "Imod", "Eday", "Temp"]
+optTypes = ["date", "time", "char(8)", "char(8)", "int", "float", "float", "float", "float", "float"]
+tables = {"inverters": (invColumns, invTypes, invItems),
+          "optimizers": (optColumns, optTypes, optItems)}
+
+# rows waiting to be committed
+commitLock = threading.Lock()
+commitThreadName = "commit thread"
+pendingRows = {"inverters": [], "optimizers": []}
+nPending = 0
+lastCommit = time.time()
+totalRows = 0
+
+# open the database and create the tables
+def openDb(dbFileName):
+    # the rows are also committed by the commit thread
+    db = sqlite3.connect(dbFileName, check_same_thread=False)
+    db.execute("pragma journal_mode=wal")
+    db.execute("pragma synchronous=normal")
+    for table in sorted(tables.keys()):
+        (columns, types, items) = tables[table]
+        db.execute("create table if not exists %s (%s, unique (Date, Time, ID))" %
+                   (table, ", ".join(columns[i]+" "+types[i] for i in range(len(columns)))))
+        # index for queries of a device
+        db.execute("create index if not exists %s_ID on %s (ID, Date, Time)" % (table, table))
+    db.commit()
+    return db
+
+# insert rows using statements that insert as many rows as possible at a time
+def insertRows(db, table, rows):
+    columns = tables[table][0]
+    rowParams = "("+", ".join("?" for column in columns)+")"
+    groupRows = maxVars / len(columns)
+    nGroups = len(rows) / groupRows
+    insertSql = "insert or replace into %s (%s) values " % (table, ", ".join(columns))
+    if nGroups > 0:
+        db.executemany(insertSql+", ".join(rowParams for i in range(groupRows)),
+                       (tuple(itertools.chain.from_iterable(rows[i*groupRows:(i+1)*groupRows])) for i in range(nGroups)))
+    if len(rows) > nGroups*groupRows:
+        db.executemany(insertSql+rowParams, rows[nGroups*groupRows:])
+
+# add the device data in a message to the pending rows
+def addData(db, msgDict):
+    global nPending
+    with commitLock:
+        for table in pendingRows.keys():
+            items = tables[table][2]
+            for devDict in msgDict[table].values():
+                pendingRows[table].append(tuple(devDict[item] for item in items))
+                nPending += 1
+        if nPending >= batchRows:
+            commitRows(db)
+
+# write the pending rows in one transaction
+# the caller must hold the commit lock
+def commitRows(db):
+    global nPending, lastCommit, totalRows
+    if nPending > 0:
+        with db:
+            for table in sorted(pendingRows.keys()):
+                insertRows(db, table, pendingRows[table])
+                del pendingRows[table][:]
+        totalRows += nPending
+        nPending = 0
+    lastCommit = time.time()
+
+# commit the pending rows when they have waited for the maximum time
+def commitTimer(db):
+    while True:
+        time.sleep(min(batchSecs, 1.0))
+        with commitLock:
+            if time.time() - lastCommit >= batchSecs:
+                commitRows(db)
+
+# start the thread that commits by time
+def startCommitTimer(db):
+    commitThread = threading.Thread(name=commitThreadName, target=commitTimer, args=(db,))
+    commitThread.daemon = True
+    commitThread.start()
+
+# load a file, following it if requested
+def loadFile(db, inFile, follow):
+    while True:
+        jsonStr = inFile.readline()
+        if jsonStr == "":
+            if not follow:
+                return
+            # wait for data
+            time.sleep(sleepInterval)
+        elif jsonStr.strip() != "":
+            addData(db, json.loads(jsonStr))
+
+if __name__ == "__main__":
+    # get program arguments and options
+    (opts, args) = getopt.getopt(sys.argv[1:], "b:fo:t:")
+    for opt in opts:
+        if opt[0] == "-b":
+            batchRows = int(opt[1])
+        elif opt[0] == "-f":
+            following = True
+        elif opt[0] == "-o":
+            dbFileName = opt[1]
+        elif opt[0] == "-t":
+            batchSecs = float(opt[1])
+    if dbFileName == "":
+        print "Database file must be specified"
+        sys.exit(1)
+    db = openDb(dbFileName)
+    startCommitTimer(db)
+    try:
+        inFiles = listDataFiles(args) or ["stdin"]
+        for inFileName in inFiles:
+            if inFileName == "stdin":
+                inFile = sys.stdin
+            else:
+                inFile = openCompressed(inFileName)
+            # only the last file is followed
+            loadFile(db, inFile, following and (inFileName == inFiles[-1]))
+            inFile.close()
+    finally:
+        with commitLock:
+            commitRows(db)
+            db.close()
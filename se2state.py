@@ -6,36 +6,85 @@ import json
 import getopt
 import time
 import sys
+import signal
+
+from seShm import *
+from seMemory import *
 
 # state values
 stateDict = {"inverters": {}, "optimizers": {}}
+outFileName = ""
+shmFileName = ""
+shmSlots = defaultSlots
+sharedState = None
+lastSeen = {}       # (device type, device ID): time
+memReportInterval = None
+memCapSize = 0
+
+# remove the devices that haven't been seen since a time from the state
+def evictDevices(before):
+    return len(evictStale(stateDict, lastSeen, before))
 
 # get program arguments and options
-(opts, args) = getopt.getopt(sys.argv[1:], "o:")
+(opts, args) = getopt.getopt(sys.argv[1:], "G:m:n:o:X:")
 try:
     inFile = open(args[0])
 except:
     inFile = sys.stdin
 for opt in opts:
-    if opt[0] == "-o":
+    if opt[0] == "-G":
+        memReportInterval = int(opt[1])
+    elif opt[0] == "-m":
+        shmFileName = opt[1]
+    elif opt[0] == "-n":
+        shmSlots = int(opt[1])
+    elif opt[0] == "-o":
         outFileName = opt[1]
-        
+    elif opt[0] == "-X":
+        try:
+            memCapSize = parseMemSize(opt[1])
+        except ValueError:
+            print "Invalid memory cap size", opt[1]
+            sys.exit(1)
+if shmFileName != "":
+    sharedState = SharedState(shmFileName, shmSlots, writer=True)
+if (memReportInterval is not None) or memCapSize:
+    startMemory(memReportInterval or 0, memCapSize)
+    signal.signal(signal.SIGUSR1, requestMemory)
+
 # read the input forever
 while True:
     jsonStr = ""
     # wait for data
     while jsonStr == "":
+        for line in checkMemory(evictDevices):
+            print line
         time.sleep(.1)
         jsonStr = inFile.readline()
     inDict = json.loads(jsonStr)
     # update the state values
     stateDict["inverters"].update(inDict["inverters"])
     stateDict["optimizers"].update(inDict["optimizers"])
+    now = time.time()
+    for devType in ["inverters", "optimizers"]:
+        for seId in inDict[devType].keys():
+            lastSeen[(devType, seId)] = now
     # zero current energy and power when an event occurs
     if len(inDict["events"]) != 0:
         for inverter in stateDict["inverters"].keys():
             stateDict["inverters"][inverter]["Eac"] = 0.0
             stateDict["inverters"][inverter]["Pac"] = 0.0
+    # update the shared state
+    if sharedState:
+        if len(inDict["events"]) != 0:
+            updatedInvs = stateDict["inverters"]
+        else:
+            updatedInvs = inDict["inverters"]
+        for inverter in updatedInvs.keys():
+            sharedState.update(devTypeInv, stateDict["inverters"][inverter])
+        for optimizer in inDict["optimizers"].keys():
+            sharedState.update(devTypeOpt, stateDict["optimizers"][optimizer])
     # update the state file
-    with open(outFileName, "w") as outFile:
-        json.dump(stateDict, outFile)
+    if outFileName != "":
+        with open(outFileName, "w") as outFile:
+            json.dump(stateDict, outFile)
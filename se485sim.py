@@ -0,0 +1,205 @@
+#!/usr/bin/python
+
+# Simulate SolarEdge slave inverters on an RS485 bus
+#
+# A pseudo-terminal is opened and its name is printed so that semonitor can use it as the
+# serial device in master mode or command mode.  Messages from the master that are
+# addressed to a simulated slave are answered:
+#
+#   master grant         the slave sends a post containing its performance data followed
+#                        by a master grant acknowledgement
+#   get version          the slave sends its firmware version
+#   get parameter        the slave sends the parameter value
+#   anything else        the slave sends a NACK
+#
+# The time it takes to send each message at the baud rate is simulated, and slaves can be
+# made silent or bytes corrupted to test error handling.  When the simulator is stopped
+# the number of grants received by each slave and the polling interval are reported.
+
+import collections
+import getopt
+import os
+import random
+import select
+import sys
+import time
+import tty
+
+# seConf parses the program arguments when it is imported
+simArgs = sys.argv[1:]
+sys.argv = sys.argv[:1]
+
+from seSynth import *
+from seData import *
+
+# parameters
+slaveIds = []
+nSlaves = 2
+nOptimizers = 20
+simBaudRate = 115200
+silentIds = []
+corruptRate = 0.0           # probability that a byte sent is corrupted
+linkName = ""
+duration = 0
+firmwareVersion = (3, 1911)
+paramValue = 0
+paramType = 0
+bitsPerByte = 10            # start, data, and stop bits
+readSize = 4096
+
+# results
+grants = collections.Counter()
+pollIntervals = collections.defaultdict(list)
+lastGrants = {}
+stats = collections.Counter()
+
+# a simulated slave inverter
+class Slave(object):
+
+    def __init__(self, idx, seId):
+        self.seId = seId
+        self.site = Site(1, nOptimizers, idx, seId, optBaseId + idx*nOptimizers)
+        self.silent = seId in silentIds
+        self.msgSeq = 0
+
+    # return the messages sent in response to a message from the master
+    def respond(self, msgSeq, fromAddr, function, data):
+        if function == PROT_CMD_POLESTAR_MASTER_GRANT:
+            now = time.time()
+            grants[self.seId] += 1
+            if self.seId in lastGrants:
+                pollIntervals[self.seId].append(now - lastGrants[self.seId])
+            lastGrants[self.seId] = now
+            if self.silent:
+                return []
+            msgs = []
+            for (inverter, postData, nDevices) in self.site.posts(int(now)):
+                self.msgSeq = (self.msgSeq + 1) & 0xffff
+                msgs.append(formatMsg(self.msgSeq, self.seId, serverAddr, PROT_CMD_SERVER_POST_DATA, postData))
+                stats["posts"] += 1
+            msgs.append(formatMsg(msgSeq, self.seId, fromAddr, PROT_RESP_POLESTAR_MASTER_GRANT_ACK))
+            return msgs
+        if self.silent:
+            return []
+        stats["commands"] += 1
+        if function == PROT_CMD_MISC_GET_VER:
+            return [formatMsg(msgSeq, self.seId, fromAddr, PROT_RESP_MISC_GET_VER, struct.pack("<HH", *firmwareVersion))]
+        elif function == PROT_CMD_PARAMS_GET_SINGLE:
+            return [formatMsg(msgSeq, self.seId, fromAddr, PROT_RESP_PARAMS_SINGLE, struct.pack("<LH", paramValue, paramType))]
+        stats["nacks"] += 1
+        return [formatMsg(msgSeq, self.seId, fromAddr, PROT_RESP_NACK)]
+
+# the bus connecting the master to the slaves
+class Bus(object):
+
+    def __init__(self, slaves):
+        self.slaves = dict((slave.seId, slave) for slave in slaves)
+        (self.masterFd, self.slaveFd) = os.openpty()
+        # the pty must pass all bytes through unchanged before semonitor opens it
+        tty.setraw(self.slaveFd)
+        self.name = os.ttyname(self.slaveFd)
+        self.inBuf = ""
+
+    # return the next complete message from the master, or None
+    def nextMsg(self):
+        while True:
+            start = self.inBuf.find(magic)
+            if start < 0:
+                self.inBuf = self.inBuf[-(magicLen-1):]
+                return None
+            self.inBuf = self.inBuf[start:]
+            if len(self.inBuf) < magicLen+msgHdrLen:
+                return None
+            dataLen = struct.unpack("<H", self.inBuf[magicLen:magicLen+2])[0]
+            msgLen = magicLen+msgHdrLen+dataLen+checksumLen
+            if len(self.inBuf) < msgLen:
+                return None
+            msg = self.inBuf[magicLen:msgLen]
+            self.inBuf = self.inBuf[msgLen:]
+            try:
+                return parseMsg(msg)
+            except Exception:
+                stats["badMsgs"] += 1
+
+    # send a message at the baud rate, corrupting bytes at the specified rate
+    def send(self, msg):
+        if corruptRate:
+            msg = "".join(chr(random.randint(0, 255)) if random.random() < corruptRate else c for c in msg)
+        time.sleep(len(msg) * bitsPerByte / float(simBaudRate))
+        os.write(self.masterFd, msg)
+        stats["msgsSent"] += 1
+
+    def run(self, endTime):
+        while (endTime == 0) or (time.time() < endTime):
+            (readable, writable, errors) = select.select([self.masterFd], [], [], .1)
+            if not readable:
+                continue
+            try:
+                self.inBuf += os.read(self.masterFd, readSize)
+            except OSError:     # the master closed the pty
+                time.sleep(.1)
+                continue
+            msg = self.nextMsg()
+            while msg:
+                (msgSeq, fromAddr, toAddr, function, data) = msg
+                stats["msgsReceived"] += 1
+                # the time it took the master to send the message
+                time.sleep((msgHdrLen+len(data)+checksumLen+magicLen) * bitsPerByte / float(simBaudRate))
+                slave = self.slaves.get(toAddr & 0xff7fffff)
+                if function == PROT_RESP_ACK:   # the master acknowledged a post
+                    stats["acks"] += 1
+                elif slave:
+                    for response in slave.respond(msgSeq, fromAddr, function, data):
+                        self.send(response)
+                msg = self.nextMsg()
+
+# print the results
+def report():
+    for name in ["msgsReceived", "msgsSent", "posts", "acks", "commands", "nacks", "badMsgs"]:
+        print "%-14s" % (name+":"), stats[name]
+    for seId in sorted(grants.keys()):
+        intervals = pollIntervals[seId]
+        print "slave %08X:" % seId, "grants:", grants[seId],
+        if intervals:
+            print "poll interval secs: avg %.2f max %.2f" % (sum(intervals) / len(intervals), max(intervals)),
+        print
+
+if __name__ == "__main__":
+    # get program arguments and options
+    (opts, args) = getopt.getopt(simArgs, "b:d:l:n:o:q:s:x:")
+    for opt in opts:
+        if opt[0] == "-b":
+            simBaudRate = int(opt[1])
+        elif opt[0] == "-d":
+            duration = float(opt[1])
+        elif opt[0] == "-l":
+            linkName = opt[1]
+        elif opt[0] == "-n":
+            nSlaves = int(opt[1])
+        elif opt[0] == "-o":
+            nOptimizers = int(opt[1])
+        elif opt[0] == "-q":
+            silentIds = [int(seId, 16) for seId in opt[1].split(",")]
+        elif opt[0] == "-s":
+            slaveIds = [int(seId, 16) for seId in opt[1].split(",")]
+        elif opt[0] == "-x":
+            corruptRate = float(opt[1])
+    if slaveIds == []:
+        slaveIds = [invBaseId + i for i in range(nSlaves)]
+    bus = Bus([Slave(i, seId) for (i, seId) in enumerate(slaveIds)])
+    deviceName = bus.name
+    if linkName != "":
+        if os.path.lexists(linkName):
+            os.remove(linkName)
+        os.symlink(bus.name, linkName)
+        deviceName = linkName
+    print "python semonitor.py -m -t 4 -s %s %s" % (",".join("%08X" % seId for seId in slaveIds), deviceName)
+    sys.stdout.flush()
+    try:
+        bus.run(time.time() + duration if duration else 0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if linkName != "":
+            os.remove(linkName)
+    report()
@@ -0,0 +1,89 @@
+# SolarEdge catalogue of unknown device types and functions
+
+# New firmware may send device records or messages that aren't understood, often in every
+# post.  Instead of logging each occurrence, they are counted by device type or function
+# code along with the data sizes that were seen and a few samples of the data.  A new type
+# is logged with a sample when it is first seen, then a summary of the types that have been
+# seen again is logged once per interval by the main loop of the program.  If a catalogue
+# file is specified the catalogue is saved to it at the same interval and when the program
+# terminates, and it is loaded again when the program starts so that counts and samples
+# accumulate across restarts.
+
+import json
+import os
+import threading
+import time
+from seConf import *
+
+catalogInterval = 10*60
+catalogSamples = 3          # different samples kept for each type
+catalogSampleLen = 256      # bytes kept in each sample
+
+catalog = {"devices": {}, "functions": {}}
+catalogLogged = {}          # (kind, code): count when the last summary was logged
+catalogTime = time.time()
+catalogLock = threading.Lock()
+
+# record an unknown device type or function
+def catalogUnknown(kind, code, data):
+    now = time.time()
+    key = "0x%04x" % code
+    with catalogLock:
+        try:
+            entry = catalog[kind][key]
+        except KeyError:
+            entry = catalog[kind][key] = {"count": 0, "sizes": {}, "first": now, "last": now, "samples": []}
+            log("Unknown", kind[:-1], key, "length:", len(data))
+            logData(data[:catalogSampleLen])
+        entry["count"] += 1
+        entry["last"] = now
+        size = str(len(data))
+        entry["sizes"][size] = entry["sizes"].get(size, 0) + 1
+        if len(entry["samples"]) < catalogSamples:
+            sample = data[:catalogSampleLen].encode("hex")
+            if sample not in entry["samples"]:
+                entry["samples"].append(sample)
+
+# log the summary and save the catalogue if the interval has expired
+def checkCatalog():
+    global catalogTime
+    now = time.time()
+    if now - catalogTime >= catalogInterval:
+        logCatalog()
+        saveCatalog()
+        catalogTime = now
+
+# log the types that have been seen since the last summary
+def logCatalog():
+    with catalogLock:
+        for kind in sorted(catalog.keys()):
+            for key in sorted(catalog[kind].keys()):
+                entry = catalog[kind][key]
+                if entry["count"] != catalogLogged.get((kind, key)):
+                    log("Unknown", kind[:-1], key, "count:", entry["count"],
+                        "sizes:", ",".join(sorted(entry["sizes"].keys(), key=int)))
+                    catalogLogged[(kind, key)] = entry["count"]
+
+# load the catalogue file if it exists
+def loadCatalog():
+    if (catalogFileName != "") and os.path.exists(catalogFileName):
+        try:
+            with open(catalogFileName) as catalogFile:
+                catalog.update(json.load(catalogFile))
+            for kind in catalog.keys():
+                for key in catalog[kind].keys():
+                    catalogLogged[(kind, key)] = catalog[kind][key]["count"]
+        except (IOError, ValueError) as ex:
+            log("Unable to read", catalogFileName, ex)
+
+# write the catalogue file, replacing the previous one
+def saveCatalog():
+    if catalogFileName != "":
+        with catalogLock:
+            catalogStr = json.dumps(catalog, indent=1, sort_keys=True)
+        try:
+            with open(catalogFileName+".tmp", "w") as catalogFile:
+                catalogFile.write(catalogStr)
+            os.rename(catalogFileName+".tmp", catalogFileName)
+        except (IOError, OSError) as ex:
+            log("Unable to write", catalogFileName, ex)
@@ -0,0 +1,147 @@
+# SolarEdge file compression
+
+import bz2
+import gzip
+import io
+import os
+import shutil
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+compressBufSize = 1024*1024
+compressThreadName = "compress thread"
+decompressBufSize = 1024*1024
+
+# signatures of compressed files
+compSignatures = [("\x1f\x8b", "gzip"),
+                  ("BZh", "bz2"),
+                  ("\xfd7zXZ\x00", "xz"),
+                  ("\x28\xb5\x2f\xfd", "zstd"),
+                  ]
+
+# file name suffixes of compressed files
+compSuffixes = [".gz", ".bz2", ".xz", ".zst"]
+
+# return True if a compressed version of a file exists
+def compressedExists(fileName):
+    return any(os.path.exists(fileName+suffix) for suffix in compSuffixes)
+
+# list the data files, expanding directories to the files they contain that have the
+# specified extension, either uncompressed or followed by a compression suffix
+def listDataFiles(fileNames, ext=".json"):
+    exts = tuple([ext] + [ext+suffix for suffix in compSuffixes])
+    dataFiles = []
+    for fileName in fileNames:
+        if os.path.isdir(fileName):
+            dataFiles += [os.path.join(fileName, name) for name in sorted(os.listdir(fileName))
+                          if name.endswith(exts)]
+        else:
+            dataFiles.append(fileName)
+    return dataFiles
+
+# the best available compression method
+def defaultMethod():
+    if zstandard:
+        return "zstd"
+    return "gzip"
+
+# compress a file and remove the original
+def compressFile(fileName, method=""):
+    if method == "":
+        method = defaultMethod()
+    with open(fileName, "rb") as inFile:
+        if method == "zstd":
+            compFileName = fileName+".zst"
+            with open(compFileName, "wb") as compFile:
+                zstandard.ZstdCompressor().copy_stream(inFile, compFile, compressBufSize, compressBufSize)
+        else:
+            compFileName = fileName+".gz"
+            compFile = gzip.open(compFileName, "wb")
+            try:
+                shutil.copyfileobj(inFile, compFile, compressBufSize)
+            finally:
+                compFile.close()
+    os.remove(fileName)
+    return compFileName
+
+# compress a file in a separate thread
+def compressBackground(fileName, method="", done=None):
+    def compress():
+        try:
+            compFileName = compressFile(fileName, method)
+            if done:
+                done(fileName, compFileName, None)
+        except Exception as ex:
+            if done:
+                done(fileName, None, ex)
+    compressThread = threading.Thread(name=compressThreadName, target=compress)
+    compressThread.start()
+    return compressThread
+
+# adapt a decompression stream to the raw I/O interface so it can be buffered
+class DecompressReader(io.RawIOBase):
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        data = self.stream.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.stream.close()
+        io.RawIOBase.close(self)
+
+# buffered reader for a decompressed file
+class CompressedFile(io.BufferedReader):
+
+    def __init__(self, stream, fileName, method):
+        io.BufferedReader.__init__(self, DecompressReader(stream), decompressBufSize)
+        self.fileName = fileName
+        self.method = method
+
+    @property
+    def name(self):
+        return self.fileName
+
+# return the compression method of a file, or "" if it isn't compressed
+def compressMethod(fileName):
+    with open(fileName, "rb") as inFile:
+        header = inFile.read(8)
+    for (signature, method) in compSignatures:
+        if header.startswith(signature):
+            return method
+    return ""
+
+# open a file for reading, decompressing it as it is read if it is compressed
+def openCompressed(fileName):
+    method = compressMethod(fileName)
+    if method == "":
+        return open(fileName, "rb", decompressBufSize)
+    elif method == "gzip":
+        stream = gzip.GzipFile(fileName, "rb")
+    elif method == "bz2":
+        stream = bz2.BZ2File(fileName, "rb", decompressBufSize)
+    elif (method == "xz") and lzma:
+        stream = lzma.LZMAFile(fileName, "rb")
+    elif (method == "zstd") and zstandard:
+        stream = zstandard.ZstdDecompressor().stream_reader(open(fileName, "rb"), decompressBufSize)
+    else:
+        raise IOError("Unable to decompress %s file %s" % (method, fileName))
+    return CompressedFile(stream, fileName, method)
@@ -9,6 +9,7 @@ import socket
 import netifaces
 import os
 import signal
+import stat
 import serial.tools.list_ports
 
 # debug flags
@@ -28,6 +29,7 @@ inputType = ""
 serialDevice = False
 baudRate = 115200
 networkDevice = False
+pcapInput = False
 
 # operating mode paramaters
 passiveMode = True
@@ -47,6 +49,22 @@ outFileName = "stdout"
 recFileName = ""
 writeMode = "w"
 updateFileName = ""
+rotateInterval = ""     # d=daily, h=hourly, or number of seconds
+rotateSize = 0
+compressFiles = False
+dedupMemory = 0
+reorderSecs = 0
+reorderRecords = 0
+
+# metrics parameters
+metricsAddr = "127.0.0.1"
+metricsPort = 0
+profileFileName = ""
+profileSecs = 60
+memDiagnostics = False
+memReportInterval = 0
+memCapSize = 0
+catalogFileName = ""
 
 # global constants
 bufSize = 1024
@@ -57,7 +75,9 @@ appName = "semonitor"
 serialFileName = "/dev/tty"
 readThreadName = "read thread"
 masterThreadName = "master thread"
+reorderThreadName = "reorder thread"
 masterMsgInterval = 5
+masterGrantTimeout = 10
 masterAddr = 0xfffffffe
 seqFileName = "seseq.txt"
 updateSize = 0x80000
@@ -135,12 +155,17 @@ def nextSeq():
         seqFile.write(str(seq)+"\n")
     return seq
 
-# block while waiting for a keyboard interrupt
-def waitForEnd():
+# block while waiting for a keyboard interrupt, then call cleanup before terminating
+# periodic is called every second while waiting
+def waitForEnd(cleanup=None, periodic=None):
     try:
         while True:
             time.sleep(1)
+            if periodic:
+                periodic()
     except KeyboardInterrupt:
+        if cleanup:
+            cleanup()
         # commit suicide
         os.kill(os.getpid(), signal.SIGKILL)
         return False
@@ -168,6 +193,32 @@ def parseCommands(opt):
         terminate(1, "Error parsing commands")
     return commands
                         
+# parse a size with an optional k, M, or G suffix
+def parseSize(opt):
+    sizeUnits = {"k": 1024, "m": 1024*1024, "g": 1024*1024*1024}
+    try:
+        if opt[-1].lower() in sizeUnits:
+            return int(opt[:-1])*sizeUnits[opt[-1].lower()]
+        return int(opt)
+    except (ValueError, IndexError):
+        terminate(1, "Invalid size "+opt)
+
+# parse the output file rotation schedule specified in the -g option
+def parseRotation(opt):
+    interval = ""
+    size = 0
+    for spec in opt.lower().split(","):
+        try:
+            if spec in ["d", "h"]:
+                interval = spec
+            elif spec[-1] in "kmg":
+                size = parseSize(spec)
+            else:
+                interval = str(int(spec))
+        except (ValueError, IndexError):
+            terminate(1, "Invalid rotation "+spec)
+    return (interval, size)
+
 # figure out the list of valid serial ports on this server
 try:
     serialPortNames = []
@@ -183,7 +234,7 @@ except:
     pass
 
 # get program arguments and options
-(opts, args) = getopt.getopt(sys.argv[1:], "ab:c:d:fmn:o:r:s:t:u:vx")
+(opts, args) = getopt.getopt(sys.argv[1:], "ab:c:D:d:fG:g:M:mn:o:p:r:s:t:U:u:vw:X:xz")
 # arguments
 try:
     inFileName = args[0]
@@ -191,6 +242,8 @@ try:
         inFileName = "stdin"
     elif inFileName in serialPortNames:
         serialDevice = True      
+    elif os.path.exists(inFileName) and stat.S_ISCHR(os.stat(inFileName).st_mode):
+        serialDevice = True      # a serial device that isn't listed, such as a pty
 except:
         inFileName = "stdin"
 # options
@@ -203,20 +256,48 @@ for opt in opts:
         commandStr = opt[1]
     elif opt[0] == "-d":
         debugFileName = opt[1]
+    elif opt[0] == "-D":
+        dedupMemory = parseSize(opt[1])
     elif opt[0] == "-f":
         following = True
+    elif opt[0] == "-G":
+        memDiagnostics = True
+        try:
+            memReportInterval = int(opt[1])
+        except ValueError:
+            terminate(1, "Invalid memory report interval "+opt[1])
+    elif opt[0] == "-g":
+        (rotateInterval, rotateSize) = parseRotation(opt[1])
+    elif opt[0] == "-M":
+        metricsSpec = opt[1].rsplit(":", 1)
+        if len(metricsSpec) > 1:
+            metricsAddr = metricsSpec[0]
+        try:
+            metricsPort = int(metricsSpec[-1])
+        except ValueError:
+            terminate(1, "Invalid metrics port "+opt[1])
     elif opt[0] == "-m":
         masterMode = True
     elif opt[0] == "-n":
         netInterface = opt[1]
     elif opt[0] == "-o":
         outFileName = opt[1]
+    elif opt[0] == "-p":
+        profileSpec = opt[1].split(",")
+        profileFileName = profileSpec[0]
+        if len(profileSpec) > 1:
+            try:
+                profileSecs = int(profileSpec[1])
+            except ValueError:
+                terminate(1, "Invalid profiling time "+profileSpec[1])
     elif opt[0] == "-r":
         recFileName = opt[1]
     elif opt[0] == "-s":
         slaveAddrs = opt[1].split(",")
     elif opt[0] == "-t":
         inputType = opt[1]
+    elif opt[0] == "-U":
+        catalogFileName = opt[1]
     elif opt[0] == "-u":
         updateFileName = opt[1]
     elif opt[0] == "-v":
@@ -229,8 +310,21 @@ for opt in opts:
                 debugData = True    # -vvv
             elif not debugRaw:
                 debugRaw = True     # -vvvv
+    elif opt[0] == "-w":
+        try:
+            if opt[1][-1] == "r":
+                reorderRecords = int(opt[1][:-1])
+            else:
+                reorderSecs = int(opt[1])
+        except (ValueError, IndexError):
+            terminate(1, "Invalid reorder window "+opt[1])
+    elif opt[0] == "-X":
+        memDiagnostics = True
+        memCapSize = parseSize(opt[1])
     elif opt[0] == "-x":
         haltOnException = True
+    elif opt[0] == "-z":
+        compressFiles = True
     else:
         terminate(1, "Unknown option "+opt[0])
 
@@ -246,10 +340,15 @@ if inputType in ["2", "4"]:
     if not serialDevice:
         terminate(1, "Input device types 2 and 4 are only valid for a serial device")
 elif inputType == "n":
-    if inFileName != "":
+    if inFileName != "stdin":
         terminate(1, "Input file cannot be specified for network mode")
     networkDevice = True
     inFileName = "network"
+    passiveMode = False
+elif inputType == "p":
+    if (inFileName == "stdin") or serialDevice:
+        terminate(1, "Input type p is only valid for a pcap file")
+    pcapInput = True
 elif inputType != "":
     terminate(1, "Invalid input type "+inputType)
     
@@ -310,6 +409,7 @@ if debugFiles:
     if serialDevice:
         log("    baudRate:", baudRate)
     log("networkDevice:", networkDevice)
+    log("pcapInput:", pcapInput)
     log("networkSvcs:", networkSvcs)
     if networkSvcs:
         log("netInterface", netInterface)
@@ -331,6 +431,27 @@ if debugFiles:
     if recFileName != "":
         log("recFileName:", recFileName)
     log("append:", writeMode)
+    if rotateInterval != "":
+        log("rotateInterval:", rotateInterval)
+    if rotateSize != 0:
+        log("rotateSize:", rotateSize)
+    log("compressFiles:", compressFiles)
+    if dedupMemory != 0:
+        log("dedupMemory:", dedupMemory)
+    if reorderSecs != 0:
+        log("reorderSecs:", reorderSecs)
+    if reorderRecords != 0:
+        log("reorderRecords:", reorderRecords)
     if updateFileName != "":
         log("updateFileName:", updateFileName)
+    if metricsPort != 0:
+        log("metrics:", metricsAddr+":"+str(metricsPort))
+    if catalogFileName != "":
+        log("catalogFileName:", catalogFileName)
+    if memDiagnostics:
+        log("memReportInterval:", memReportInterval)
+        log("memCapSize:", memCapSize)
+    if profileFileName != "":
+        log("profileFileName:", profileFileName)
+        log("    profileSecs:", profileSecs)
 
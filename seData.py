@@ -5,6 +5,8 @@ import json
 from seConf import *
 from seCommands import *
 from seDataParams import *
+from seMetrics import *
+from seCatalog import *
 
 # parse the message data
 def parseData(function, data, command=0x0):
@@ -48,7 +50,10 @@ def parseData(function, data, command=0x0):
         pass
     else:
         # unknown function type
-        raise Exception("Unknown function 0x%04x" % function)
+        countMetric("unknown_functions_total", 'function="0x%04x"' % function)
+        catalogUnknown("functions", function, data)
+        if haltOnException:
+            raise Exception("Unknown function 0x%04x" % function)
     return {}
 
 def parseOpMode(data):
@@ -148,8 +153,8 @@ def parseDeviceData(data):
             eventDict[seId] = parseEventData(seId, eventItems, data[dataPtr:dataPtr+devLen])
             logDevice("event:         ", seType, seId, devLen, eventDict[seId])
         else:   # unknown device type
-            log("Unknown device 0x%04x" % seType)
-            logData(data[dataPtr-devHdrLen:dataPtr+devLen])
+            countMetric("unknown_devices_total", 'type="0x%04x"' % seType)
+            catalogUnknown("devices", seType, data[dataPtr-devHdrLen:dataPtr+devLen])
         dataPtr += devLen
     return {"inverters": invDict, "optimizers": optDict, "events": eventDict}
 
@@ -200,11 +205,16 @@ def devDataDict(seId, itemNames, itemValues):
 def writeData(msgDict, outFile, outSeq):
     if outFile:
         outSeq += 1
+        serializeStart = time.time()
         msg = json.dumps(msgDict)
+        observeMetric("stage_seconds", time.time() - serializeStart, stageSerialize)
         logMsg("<--", outSeq, msg, outFile.name)
         debug("debugData", msg)
+        writeStart = time.time()
         outFile.write(msg+"\n")
         outFile.flush()
+        observeMetric("stage_seconds", time.time() - writeStart, stageWrite)
+        countMetric("records_out_total")
     return outSeq
         
 # remove the extra bit that is sometimes set in a device ID and upcase the letters
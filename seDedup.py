@@ -0,0 +1,97 @@
+# SolarEdge duplicate device data removal
+
+# Devices resend data that was buffered while a connection was down, and overlapping
+# recordings contain the same data more than once.  Device records are identified by
+# the device type, device ID, and device time stamp.  The most recent keys are kept
+# exactly, and keys that are evicted from the recent window are added to a bloom
+# filter.  Two generations of bloom filter are kept so the oldest keys are forgotten
+# when the current generation is full.  Memory use is limited to the specified cap.
+
+import collections
+import hashlib
+import struct
+import time
+from seConf import *
+
+recentKeyBytes = 200    # approximate memory used by each recent key
+bloomHashes = 7
+bloomBitsPerKey = 10    # about 1% false positives
+statsInterval = 60*60
+
+class DedupFilter(object):
+
+    def __init__(self, memCap):
+        self.maxRecent = max(1, memCap/2/recentKeyBytes)
+        self.bloomBits = max(8, memCap/2/2*8)    # half for bloom filters in two generations
+        self.bloomCapacity = self.bloomBits/bloomBitsPerKey
+        self.recent = collections.OrderedDict()
+        self.blooms = [bytearray(self.bloomBits/8), bytearray(self.bloomBits/8)]
+        self.bloomKeys = 0
+        self.records = 0
+        self.duplicates = 0
+        self.recentDuplicates = 0
+        self.bloomDuplicates = 0
+        self.statsTime = time.time()
+
+    # bit positions of a key in the bloom filter
+    def bloomPositions(self, key):
+        (h1, h2) = struct.unpack("<QQ", hashlib.md5(key).digest())
+        return [(h1 + i*h2) % self.bloomBits for i in range(bloomHashes)]
+
+    def bloomContains(self, key):
+        positions = self.bloomPositions(key)
+        for bloom in self.blooms:
+            for pos in positions:
+                if not bloom[pos >> 3] & (1 << (pos & 7)):
+                    break
+            else:
+                return True
+        return False
+
+    def bloomAdd(self, key):
+        if self.bloomKeys >= self.bloomCapacity:
+            # start a new generation and forget the oldest one
+            self.blooms = [bytearray(self.bloomBits/8), self.blooms[0]]
+            self.bloomKeys = 0
+        bloom = self.blooms[0]
+        for pos in self.bloomPositions(key):
+            bloom[pos >> 3] |= 1 << (pos & 7)
+        self.bloomKeys += 1
+
+    # return True if the key has been seen before, otherwise remember it
+    def isDuplicate(self, key):
+        self.records += 1
+        if key in self.recent:
+            self.recentDuplicates += 1
+        elif self.bloomContains(key):
+            self.bloomDuplicates += 1
+        else:
+            self.recent[key] = True
+            if len(self.recent) > self.maxRecent:
+                self.bloomAdd(self.recent.popitem(last=False)[0])
+            return False
+        self.duplicates += 1
+        return True
+
+    # remove the device records in a message that have been seen before
+    # returns False if there is nothing left
+    def filterMsg(self, msgDict):
+        remaining = False
+        for devType in ["inverters", "optimizers", "events"]:
+            devices = msgDict.get(devType, {})
+            for seId in devices.keys():
+                devDict = devices[seId]
+                key = "%s %s %s %s" % (devType, seId, devDict.get("Date", ""), devDict.get("Time", ""))
+                if self.isDuplicate(key):
+                    debug("debugData", "duplicate", devType, seId, devDict.get("Date", ""), devDict.get("Time", ""))
+                    del devices[seId]
+                else:
+                    remaining = True
+        if time.time() - self.statsTime >= statsInterval:
+            self.logStats()
+        return remaining
+
+    def logStats(self):
+        self.statsTime = time.time()
+        log("dedup records:", self.records, "duplicates:", self.duplicates,
+            "recent:", self.recentDuplicates, "approximate:", self.bloomDuplicates)
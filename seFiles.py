@@ -3,8 +3,186 @@
 import serial
 import sys
 import socket
+import os
+import time
+import threading
+import collections
 from seConf import *
 from seNetwork import *
+from seCompress import *
+from sePcap import *
+
+# output file that is rotated on a time or size schedule
+class RotatingFile(object):
+
+    def __init__(self, fileName, writeMode="w", interval="", size=0, compress=False):
+        self.fileName = fileName
+        self.writeMode = writeMode
+        self.interval = interval
+        self.size = size
+        self.compress = compress
+        self.lock = threading.Lock()
+        self.file = None
+        self.open()
+
+    # file name of a segment starting at the specified time
+    def segmentName(self, startTime):
+        if "%" in self.fileName:
+            return time.strftime(self.fileName, time.localtime(startTime))
+        (base, ext) = os.path.splitext(self.fileName)
+        return base+time.strftime("-%Y%m%d%H%M%S", time.localtime(startTime))+ext
+
+    # time when the segment starting at the specified time ends
+    def segmentEnd(self, startTime):
+        if self.interval == "d":
+            tm = time.localtime(startTime+24*60*60)
+            return time.mktime((tm.tm_year, tm.tm_mon, tm.tm_mday, 0, 0, 0, 0, 0, -1))
+        elif self.interval == "h":
+            return startTime - startTime % (60*60) + 60*60
+        elif self.interval != "":
+            interval = int(self.interval)
+            return startTime - startTime % interval + interval
+        return float("inf")
+
+    def open(self, rotating=False):
+        startTime = time.time()
+        self.name = self.segmentName(startTime)
+        # an existing segment is appended to when the program is restarted unless it has been
+        # compressed or is full, but not when rotating because the size limit was reached
+        (base, ext) = os.path.splitext(self.name)
+        segment = 0
+        segmentName = self.name
+        while compressedExists(segmentName) or (os.path.exists(segmentName) and
+                (rotating or (self.size and (os.path.getsize(segmentName) >= self.size)))):
+            segment += 1
+            segmentName = "%s-%d%s" % (base, segment, ext)
+        self.name = segmentName
+        self.endTime = self.segmentEnd(startTime)
+        self.file = open(self.name, "a" if os.path.exists(self.name) else self.writeMode)
+        self.file.seek(0, os.SEEK_END)
+        self.written = self.file.tell()
+        debug("debugFiles", "writing", self.name)
+
+    # close the current segment, compress it, and start a new one
+    def rotate(self):
+        oldName = self.name
+        self.file.close()
+        debug("debugFiles", "closing", oldName)
+        self.open(True)
+        if self.compress:
+            compressBackground(oldName, done=self.compressed)
+
+    def compressed(self, fileName, compFileName, ex):
+        if ex:
+            log("Unable to compress", fileName, ex)
+        else:
+            debug("debugFiles", "compressed", fileName, "to", compFileName)
+
+    def write(self, data):
+        with self.lock:
+            if (time.time() >= self.endTime) or (self.size and (self.written >= self.size)):
+                self.rotate()
+            self.file.write(data)
+            self.written += len(data)
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+# stream of the data sent to the server in a pcap file
+# the TCP segments are reassembled as the stream is read, and the receive time of the
+# last message that was read is the time stamp of the packet containing its last byte
+class PcapStream(object):
+
+    def __init__(self, fileName):
+        self.name = fileName
+        self.pcapFile = PcapFile(fileName, following)
+        self.tcpFlows = TcpFlows()
+        self.buf = ""
+        self.pos = 0
+        self.bufStart = 0                           # stream offset of the start of the buffer
+        self.chunkTimes = collections.deque()       # stream offset of the end of each chunk and its time stamp
+        self.flushed = False
+        self.recvTime = 0
+
+    # add the data in a list of chunks to the buffer
+    def append(self, timeStamp, chunks):
+        self.buf += "".join(str(chunk) for chunk in chunks)
+        self.chunkTimes.append((self.bufStart+len(self.buf), timeStamp))
+
+    # read packets until there is more data in the stream, returns False at the end of the file
+    def fill(self):
+        while True:
+            rec = self.pcapFile.readRec()
+            if rec:
+                (timeStamp, pkt) = rec
+                segment = tcpSegment(pkt)
+                if segment and (segment[3] == sePort):
+                    chunks = self.tcpFlows.add(segment)
+                    if chunks:
+                        self.append(timeStamp, chunks)
+                        return True
+            elif following:
+                time.sleep(sleepInterval)
+            elif not self.flushed:
+                # write the data that is being held for incomplete streams
+                self.flushed = True
+                for (flowKey, chunks) in self.tcpFlows.flush():
+                    if chunks:
+                        self.append(self.recvTime, chunks)
+                return len(self.buf) > self.pos
+            else:
+                return False
+
+    # discard the data that has been read
+    def compact(self):
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.bufStart += self.pos
+            self.pos = 0
+
+    # set the receive time from the time stamp of the chunk containing a stream offset
+    def setRecvTime(self, offset):
+        while (len(self.chunkTimes) > 1) and (self.chunkTimes[0][0] <= offset):
+            self.chunkTimes.popleft()
+        if self.chunkTimes:
+            self.recvTime = self.chunkTimes[0][1]
+
+    # return the specified number of bytes, or fewer at the end of the file
+    def read(self, length):
+        self.compact()
+        while (len(self.buf) < length) and self.fill():
+            pass
+        data = self.buf[:length]
+        self.pos = len(data)
+        self.setRecvTime(self.bufStart+self.pos-1)
+        return data
+
+    # return the data up to and including the next occurrence of a separator, or the
+    # remaining data at the end of the file
+    def readTo(self, separator):
+        self.compact()
+        searchFrom = 0
+        while True:
+            end = self.buf.find(separator, searchFrom)
+            if end >= 0:
+                end += len(separator)
+                break
+            searchFrom = max(0, len(self.buf)-len(separator)+1)
+            if not self.fill():
+                end = len(self.buf)
+                break
+        data = self.buf[:end]
+        self.pos = end
+        self.setRecvTime(self.bufStart+end-len(separator)-1)
+        return data
+
+    def close(self):
+        self.pcapFile.close()
 
 # open data socket and wait for connection from inverter
 def openDataSocket():
@@ -35,8 +213,10 @@ def openInFile(inFileName):
     try:
         if inFileName == "stdin":
             return sys.stdin
+        elif pcapInput:
+            return PcapStream(inFileName)
         else:
-            return open(inFileName)
+            return openCompressed(inFileName)
     except:
         terminate(1, "Unable to open "+inFileName)
 
@@ -65,6 +245,8 @@ def closeData(dataFile):
 def openOutFile(fileName, writeMode="w"):
     if fileName != "":
         try:
+            if (rotateInterval != "") or (rotateSize != 0):
+                return RotatingFile(fileName, writeMode, rotateInterval, rotateSize, compressFiles)
             return open(fileName, writeMode)
             debug("debugFiles", "writing", fileName)
         except:
@@ -0,0 +1,121 @@
+# SolarEdge memory diagnostics
+
+# Programs that run for days can report their memory use at an interval or when they are
+# signalled.  If tracemalloc is available the report lists the allocation sites that use the
+# most memory and the ones that have grown the most since the previous report, otherwise it
+# lists the numbers of objects of each type that are tracked by the garbage collector.
+#
+# A soft cap can be placed on the resident set size.  When it is exceeded the program is
+# asked to evict the devices that haven't been seen for a day, because the state of every
+# device that has ever been seen is otherwise kept forever.  This module doesn't import seConf
+# so that programs that have their own arguments can use it.
+
+import collections
+import gc
+import os
+import resource
+import time
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+memTopN = 10            # number of allocation sites or types reported
+memTraceFrames = 1
+capInterval = 60        # how often the cap is checked if there are no periodic reports
+staleSecs = 24*60*60    # devices that haven't been seen for this long can be evicted
+
+memEnabled = False
+memInterval = 0
+memReports = False
+memCap = 0
+memRequested = False
+lastCheck = 0
+lastSnapshot = None
+lastTypeCounts = {}
+
+# start memory diagnostics with reports every interval seconds and a soft cap in bytes
+# an interval of 0 means that reports are only made when they are requested
+def startMemory(interval=0, cap=0):
+    global memEnabled, memInterval, memReports, memCap, lastCheck
+    memEnabled = True
+    memReports = interval > 0
+    memInterval = interval if memReports else capInterval
+    memCap = cap
+    lastCheck = time.time()
+    if tracemalloc and not tracemalloc.is_tracing():
+        tracemalloc.start(memTraceFrames)
+
+# request a report, this can be used as a signal handler
+def requestMemory(signum=None, frame=None):
+    global memRequested
+    memRequested = True
+
+# parse a size with an optional k, M, or G suffix
+def parseMemSize(opt):
+    sizeUnits = {"k": 1024, "m": 1024*1024, "g": 1024*1024*1024}
+    if opt[-1:].lower() in sizeUnits:
+        return int(opt[:-1])*sizeUnits[opt[-1].lower()]
+    return int(opt)
+
+# return the current resident set size in bytes
+def currentRss():
+    try:
+        with open("/proc/self/statm") as statmFile:
+            return int(statmFile.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, ValueError, IndexError):
+        # the peak size is the best that is available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# return the lines of a memory report
+def memoryReport():
+    global lastSnapshot, lastTypeCounts
+    lines = ["memory rss: %d KB" % (currentRss() / 1024)]
+    if tracemalloc:
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        for stat in snapshot.statistics("lineno")[:memTopN]:
+            lines.append("memory top: %d KB %d blocks %s" % (stat.size / 1024, stat.count, stat.traceback[0]))
+        if lastSnapshot:
+            for stat in snapshot.compare_to(lastSnapshot, "lineno")[:memTopN]:
+                if stat.size_diff > 0:
+                    lines.append("memory growth: %+d KB %+d blocks %s" % (stat.size_diff / 1024, stat.count_diff, stat.traceback[0]))
+        lastSnapshot = snapshot
+    else:
+        typeCounts = collections.Counter(type(obj).__name__ for obj in gc.get_objects())
+        for (typeName, count) in typeCounts.most_common(memTopN):
+            lines.append("memory objects: %-20s %d" % (typeName, count))
+        if lastTypeCounts:
+            growth = sorted(((count - lastTypeCounts.get(typeName, 0), typeName) for (typeName, count) in typeCounts.items()), reverse=True)
+            for (diff, typeName) in growth[:memTopN]:
+                if diff > 0:
+                    lines.append("memory growth: %-20s %+d" % (typeName, diff))
+        lastTypeCounts = dict(typeCounts)
+    return lines
+
+# make a report if one is due or has been requested, and if the cap has been exceeded call
+# evict with the time before which devices are stale, which returns the number evicted
+# returns the lines to be logged
+def checkMemory(evict=None):
+    global memRequested, lastCheck
+    now = time.time()
+    if not memEnabled or not (memRequested or (now - lastCheck >= memInterval)):
+        return []
+    lines = []
+    if memRequested or memReports:
+        lines += memoryReport()
+    memRequested = False
+    lastCheck = now
+    if memCap and (currentRss() > memCap):
+        nEvicted = evict(now - staleSecs) if evict else 0
+        lines.append("memory cap of %d KB exceeded, %d stale devices evicted" % (memCap / 1024, nEvicted))
+    return lines
+
+# remove the devices that were last seen before a time from a state dictionary
+# lastSeen is a dictionary of (device type, device ID): time
+# returns a list of the (device type, device ID) that were removed
+def evictStale(stateDict, lastSeen, before):
+    evicted = [devKey for (devKey, seenTime) in lastSeen.items() if seenTime < before]
+    for (devType, seId) in evicted:
+        stateDict[devType].pop(seId, None)
+        del lastSeen[(devType, seId)]
+    return evicted
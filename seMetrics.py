@@ -0,0 +1,232 @@
+# SolarEdge monitoring metrics
+
+# Counters, gauges, and histograms are kept in memory and can be served in the Prometheus
+# text format from a local HTTP port, so that a broken connection, increasing checksum
+# errors, or a slow output file can be seen while semonitor is running.  A metric is
+# identified by its name and an optional label string such as 'type="checksum"'.
+#
+# The time spent in each stage of message processing is kept in a histogram.  A summary of
+# the stage times is logged by the thread that reads messages after SIGUSR1 is received, and
+# SIGUSR2 starts or stops profiling that thread.
+
+import BaseHTTPServer
+import bisect
+import cProfile
+import threading
+import time
+from seConf import *
+
+metricsThreadName = "metrics thread"
+metricsPath = "/metrics"
+metricsPrefix = "semonitor_"
+latencyBuckets = [.00001, .00005, .0001, .0005, .001, .005, .01, .05, .1, .5, 1.0, 5.0, 10.0]
+
+# message processing stages
+stageNames = ["read", "frame", "crc", "decode", "serialize", "write"]
+stageRead = 'stage="read"'
+stageFrame = 'stage="frame"'
+stageCrc = 'stage="crc"'
+stageDecode = 'stage="decode"'
+stageSerialize = 'stage="serialize"'
+stageWrite = 'stage="write"'
+
+# metric types and descriptions
+metricDefs = {
+    "frames_in_total": ("counter", "Messages read from the data source"),
+    "bytes_in_total": ("counter", "Bytes of messages read from the data source"),
+    "frames_out_total": ("counter", "Messages sent to the data source"),
+    "bytes_out_total": ("counter", "Bytes of messages sent to the data source"),
+    "last_frame_in_seconds": ("gauge", "Time the last message was read"),
+    "parse_errors_total": ("counter", "Messages that could not be parsed by type of error"),
+    "unknown_functions_total": ("counter", "Messages with an unknown function code"),
+    "unknown_devices_total": ("counter", "Device records with an unknown device type"),
+    "exceptions_total": ("counter", "Messages that caused an exception while being processed"),
+    "reconnects_total": ("counter", "Network connections that were reestablished"),
+    "records_out_total": ("counter", "Performance data records written"),
+    "stage_seconds": ("histogram", "Time spent in each stage of message processing"),
+    "ack_seconds": ("histogram", "Time from receiving a message to sending the response"),
+    "device_last_seen_seconds": ("gauge", "Time the last data was received from a device"),
+    "start_time_seconds": ("gauge", "Time semonitor was started"),
+    }
+
+metricsLock = threading.Lock()
+counters = {}       # (name, labels): value
+gauges = {}         # (name, labels): value
+histograms = {}     # (name, labels): [count in each bucket..., count above the last bucket, sum]
+
+# add to a counter
+def countMetric(name, labels="", n=1):
+    with metricsLock:
+        counters[(name, labels)] = counters.get((name, labels), 0) + n
+
+# set the value of a gauge
+def setMetric(name, value, labels=""):
+    with metricsLock:
+        gauges[(name, labels)] = value
+
+# add an observation to a histogram
+def observeMetric(name, value, labels=""):
+    with metricsLock:
+        try:
+            hist = histograms[(name, labels)]
+        except KeyError:
+            hist = histograms[(name, labels)] = [0]*(len(latencyBuckets)+2)
+        hist[bisect.bisect_left(latencyBuckets, value)] += 1
+        hist[-1] += value
+
+# record the time that data was received from each device in a performance data message
+def devicesSeen(msgData, timeStamp):
+    with metricsLock:
+        for devType in ["inverters", "optimizers"]:
+            for seId in msgData.get(devType, {}):
+                gauges[("device_last_seen_seconds", 'id="%s"' % seId)] = timeStamp
+
+# forget the devices that were last seen before a time, returns the number forgotten
+def evictDevices(before):
+    with metricsLock:
+        stale = [key for (key, value) in gauges.items() if (key[0] == "device_last_seen_seconds") and (value < before)]
+        for key in stale:
+            del gauges[key]
+    return len(stale)
+
+# format a metric name and labels
+def metricName(name, labels):
+    if labels != "":
+        return metricsPrefix+name+"{"+labels+"}"
+    return metricsPrefix+name
+
+# return the metrics in the Prometheus text format
+def formatMetrics():
+    with metricsLock:
+        values = dict(counters)
+        values.update(gauges)
+        hists = dict((key, list(hist)) for (key, hist) in histograms.items())
+    lines = []
+    lastName = ""
+    for (name, labels) in sorted(values.keys() + hists.keys()):
+        if name != lastName:
+            (metricType, metricHelp) = metricDefs.get(name, ("untyped", name))
+            lines.append("# HELP %s%s %s" % (metricsPrefix, name, metricHelp))
+            lines.append("# TYPE %s%s %s" % (metricsPrefix, name, metricType))
+            lastName = name
+        if (name, labels) in hists:
+            hist = hists[(name, labels)]
+            sep = "," if labels != "" else ""
+            count = 0
+            for (bucket, n) in zip(latencyBuckets + ["+Inf"], hist[:-1]):
+                count += n
+                lines.append("%s %d" % (metricName(name+"_bucket", labels+sep+'le="%s"' % bucket), count))
+            lines.append("%s %f" % (metricName(name+"_sum", labels), hist[-1]))
+            lines.append("%s %d" % (metricName(name+"_count", labels), count))
+        else:
+            lines.append("%s %s" % (metricName(name, labels), repr(values[(name, labels)])))
+    return "\n".join(lines)+"\n"
+
+# return the upper bound of the bucket that contains a percentile of a histogram
+def histPercentile(hist, pct):
+    count = sum(hist[:-1])
+    n = 0
+    for (bucket, bucketCount) in zip(latencyBuckets + [float("inf")], hist[:-1]):
+        n += bucketCount
+        if n >= count * pct / 100.0:
+            return bucket
+    return float("inf")
+
+# request a summary of the time spent in each stage
+# signal handlers only set a flag because the metrics lock may be held when the signal arrives
+stagesRequested = False
+
+def requestStages(signum=None, frame=None):
+    global stagesRequested
+    stagesRequested = True
+
+# log the summary if it has been requested
+def checkStages():
+    global stagesRequested
+    if stagesRequested:
+        stagesRequested = False
+        logStages()
+
+# log a summary of the time spent in each stage
+def logStages():
+    with metricsLock:
+        hists = dict((labels, list(hist)) for ((name, labels), hist) in histograms.items() if name == "stage_seconds")
+    for stage in stageNames:
+        hist = hists.get('stage="%s"' % stage)
+        if hist:
+            count = sum(hist[:-1])
+            log("stage %-10s" % stage, "count:", count, "total secs: %.3f" % hist[-1],
+                "avg ms: %.3f" % (1000 * hist[-1] / count),
+                "p50 ms <= %g" % (1000 * histPercentile(hist, 50)),
+                "p99 ms <= %g" % (1000 * histPercentile(hist, 99)))
+
+# profiling
+#
+# Profiling is started and stopped by the thread that reads messages, because cProfile only
+# profiles the thread that enables it.  The signal handler only sets a flag that is checked
+# for each message.
+
+profiler = None
+profileRequested = False
+profileEnd = 0
+
+# request that profiling be started or stopped
+def toggleProfile(signum=None, frame=None):
+    global profileRequested
+    profileRequested = True
+
+# start or stop profiling if it has been requested or the profiling time has expired
+def checkProfile():
+    global profiler, profileRequested, profileEnd
+    if profileRequested:
+        profileRequested = False
+        if profiler:
+            stopProfile()
+        else:
+            log("profiling for", profileSecs, "seconds")
+            profileEnd = time.time() + profileSecs
+            profiler = cProfile.Profile()
+            profiler.enable()
+    elif profiler and (time.time() > profileEnd):
+        stopProfile()
+
+# stop profiling and write the results
+def stopProfile():
+    global profiler
+    profiler.disable()
+    try:
+        profiler.dump_stats(profileFileName)
+        log("profile written to", profileFileName)
+    except IOError as ex:
+        log("Unable to write profile", profileFileName, ex)
+    profiler = None
+
+# HTTP request handler for the metrics endpoint
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != metricsPath:
+            self.send_error(404)
+            return
+        body = formatMetrics()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # log requests at the -vv level instead of to stderr
+    def log_message(self, format, *args):
+        debug("debugMsgs", "metrics request from", self.address_string(), format % args)
+
+# serve the metrics from a thread
+def startMetrics(addr, port):
+    try:
+        server = BaseHTTPServer.HTTPServer((addr, port), MetricsHandler)
+    except Exception as ex:
+        terminate(1, "Unable to open metrics port "+str(port)+" "+str(ex))
+    setMetric("start_time_seconds", time.time())
+    metricsThread = threading.Thread(name=metricsThreadName, target=server.serve_forever)
+    metricsThread.daemon = True
+    metricsThread.start()
+    debug("debugFiles", "starting", metricsThreadName, "on", addr+":"+str(port))
@@ -3,6 +3,7 @@
 import struct
 import time
 from seConf import *
+from seMetrics import *
 
 # message constants
 magic = "\x12\x34\x56\x79"
@@ -15,28 +16,43 @@ inputSeq = 1
 outputSeq = 1
 
 # return the next message
+# the read time starts when the first byte of the message arrives, so that the time spent
+# waiting for a device to send data isn't included
 def readMsg(inFile, seq, outFile):
+    readStart = time.time()
     seq += 1
     msg = ""
     if not passiveMode:
         # read the magic number and header
-        msg = readBytes(inFile, magicLen+msgHdrLen)
+        msg = readBytes(inFile, 1)
         if msg == "":
             debug("debugFiles", "end of file")
             return (msg, seq)
+        readStart = time.time()
+        msg += readBytes(inFile, magicLen+msgHdrLen-1)
         (dataLen, dataLenInv, msgSeq, fromAddr, toAddr, function) = struct.unpack("<HHHLLH", msg[magicLen:])
         # read the data and checksum
         msg += readBytes(inFile, dataLen+checksumLen)
         msg = msg[magicLen:]
+    elif hasattr(inFile, "readTo"):
+        # read until the next magic number
+        msg = inFile.readTo(magic)[:-magicLen]
     else:
         # read 1 byte at a time until the next magic number
         while msg[-magicLen:] != magic:
             nextByte = readBytes(inFile, 1)
             if nextByte == "":
                 break
+            if msg == "":
+                readStart = time.time()
             msg += nextByte
         msg = msg[:-magicLen]
     logMsg("-->", seq, magic+msg, inFile.name)
+    if msg != "":
+        observeMetric("stage_seconds", time.time() - readStart, stageRead)
+        countMetric("frames_in_total")
+        countMetric("bytes_in_total", n=magicLen+len(msg))
+        setMetric("last_frame_in_seconds", time.time())
     if outFile:
         outFile.write(magic+msg)
         outFile.flush()
@@ -61,18 +77,25 @@ def readBytes(inFile, length):
 # parse a message            
 def parseMsg(msg):
     if len(msg) < msgHdrLen + checksumLen:   # throw out messages that are too short
+        countMetric("parse_errors_total", 'type="short"')
         return (0, 0, 0, 0, "")
     else:
         # parse the message header
+        frameStart = time.time()
         (dataLen, dataLenInv, msgSeq, fromAddr, toAddr, function) = struct.unpack("<HHHLLH", msg[0:msgHdrLen])
         logMsgHdr(dataLen, dataLenInv, msgSeq, fromAddr, toAddr, function)
         data = msg[msgHdrLen:msgHdrLen+dataLen]
         # validate the message
         checksum = struct.unpack("<H", msg[msgHdrLen+dataLen:msgHdrLen+dataLen+checksumLen])[0]
+        crcStart = time.time()
         calcsum = calcCrc(struct.pack(">HLLH", msgSeq, fromAddr, toAddr, function)+data)
+        observeMetric("stage_seconds", time.time() - crcStart, stageCrc)
+        observeMetric("stage_seconds", crcStart - frameStart, stageFrame)
         if calcsum != checksum:
+            countMetric("parse_errors_total", 'type="checksum"')
             raise Exception("Checksum error. Expected 0x%04x, got 0x%04x" % (checksum, calcsum))
         if dataLen != ~dataLenInv & 0xffff:
+            countMetric("parse_errors_total", 'type="length"')
             raise Exception("Length error")
         return (msgSeq, fromAddr, toAddr, function, data)
 
@@ -89,6 +112,8 @@ def sendMsg(dataFile, msg, seq, outFile):
     logMsg("<--", seq, msg, dataFile.name)
     dataFile.write(msg)
     dataFile.flush()
+    countMetric("frames_out_total")
+    countMetric("bytes_out_total", n=len(msg))
     if outFile:
         outFile.write(msg)
         outFile.flush()
@@ -0,0 +1,321 @@
+# SolarEdge pcap file reading
+
+# Uncompressed capture files are memory mapped and records are located by offset, so
+# packet data is returned as a slice of the map without being copied.  Compressed files
+# and files that are being followed as they grow are read as a stream.
+
+import bisect
+import mmap
+import os
+import struct
+
+from seCompress import *
+
+# file constants
+pcapFileHdrLen = 24
+pcapRecHdrLen = 16
+etherHdrLen = 14
+vlanTagLen = 4
+
+# protocol constants
+etherTypeIp = 0x0800
+etherTypeVlan = 0x8100
+ipProtoTcp = 6
+tcpFin = 0x01
+tcpSyn = 0x02
+tcpRst = 0x04
+
+# maximum number of out of order bytes held for each TCP flow
+tcpWindow = 1024*1024
+
+# index file constants
+idxSuffix = ".idx"
+idxMagic = "SEPX"
+idxBucketSecs = 60
+idxHdr = struct.Struct("<4sLQ")     # magic, bucket size, length of the pcap file that has been indexed
+idxRec = struct.Struct("<LQ")       # bucket start time, offset of the first record in the bucket
+
+# byte order and time stamp resolution for each pcap magic number
+pcapMagics = {"\xd4\xc3\xb2\xa1": ("<", 1000000),
+              "\xa1\xb2\xc3\xd4": (">", 1000000),
+              "\x4d\x3c\xb2\xa1": ("<", 1000000000),
+              "\xa1\xb2\x3c\x4d": (">", 1000000000),
+              }
+
+ipHdr = struct.Struct("!BxHxxxxxBxxLL")
+tcpHdr = struct.Struct("!HHLxxxxBB")
+
+class PcapFile(object):
+
+    def __init__(self, fileName, follow=False):
+        self.fileName = fileName
+        self.map = None
+        self.file = None
+        self.seq = 0
+        if (not follow) and (compressMethod(fileName) == "") and (os.path.getsize(fileName) > pcapFileHdrLen):
+            with open(fileName, "rb") as mapFile:
+                self.map = mmap.mmap(mapFile.fileno(), 0, access=mmap.ACCESS_READ)
+            self.size = len(self.map)
+            fileHdr = self.map[:pcapFileHdrLen]
+            self.readRec = self.readMapRec
+        else:
+            if follow:
+                self.file = open(fileName, "rb")
+            else:
+                self.file = openCompressed(fileName)
+            fileHdr = self.file.read(pcapFileHdrLen)
+            self.readRec = self.readStreamRec
+        try:
+            (byteOrder, self.tsRes) = pcapMagics[fileHdr[:4]]
+        except KeyError:
+            self.close()
+            raise IOError("Not a pcap file "+fileName)
+        self.fileHdr = struct.unpack(byteOrder+"LHHLLLL", fileHdr)
+        self.recHdr = struct.Struct(byteOrder+"LLLL")
+        self.offset = pcapFileHdrLen
+
+    # return the time stamp and data of the next record in a memory map, or None at the end
+    def readMapRec(self):
+        if self.offset + pcapRecHdrLen > self.size:
+            return None
+        (tsSec, tsFrac, recLen, origLen) = self.recHdr.unpack_from(self.map, self.offset)
+        start = self.offset + pcapRecHdrLen
+        if start + recLen > self.size:     # truncated record
+            return None
+        self.offset = start + recLen
+        self.seq += 1
+        return (tsSec + float(tsFrac)/self.tsRes, buffer(self.map, start, recLen))
+
+    # return the time stamp and data of the next record in a stream, or None at the end
+    # a partial record at the end of the file is read again the next time
+    def readStreamRec(self):
+        recHdr = self.file.read(pcapRecHdrLen)
+        if len(recHdr) == pcapRecHdrLen:
+            (tsSec, tsFrac, recLen, origLen) = self.recHdr.unpack(recHdr)
+            data = self.file.read(recLen)
+            if len(data) == recLen:
+                self.offset += pcapRecHdrLen + recLen
+                self.seq += 1
+                return (tsSec + float(tsFrac)/self.tsRes, data)
+        if recHdr and not isinstance(self.file, CompressedFile):
+            self.file.seek(self.offset)
+        return None
+
+    # continue reading at the specified offset
+    def seek(self, offset):
+        if self.file:
+            self.file.seek(offset)
+        self.offset = offset
+
+    # iterate through the time stamps and data of the records
+    def records(self):
+        rec = self.readRec()
+        while rec:
+            yield rec
+            rec = self.readRec()
+
+    def close(self):
+        if self.map:
+            self.map.close()
+            self.map = None
+        if self.file:
+            self.file.close()
+            self.file = None
+
+# pcap file indexes
+#
+# The index of a pcap file is written to a file with the same name followed by .idx.  It
+# contains a header followed by a record for each time bucket that contains packets, which
+# is the offset of the first pcap record in the bucket.  Indexes are extended from the end
+# of the last indexed record, so a file that is being written to can be reindexed cheaply.
+# Compressed files are not indexed.
+
+# read the index of a pcap file
+# returns the bucket size, the length of the file that has been indexed, and a list of (time, offset)
+def readPcapIndex(fileName):
+    try:
+        with open(fileName+idxSuffix, "rb") as idxFile:
+            idxData = idxFile.read()
+        (magic, bucketSecs, indexedTo) = idxHdr.unpack_from(idxData)
+        if magic == idxMagic:
+            nRecs = (len(idxData) - idxHdr.size) / idxRec.size
+            return (bucketSecs, indexedTo, [idxRec.unpack_from(idxData, idxHdr.size + i*idxRec.size)
+                                            for i in xrange(nRecs)])
+    except (IOError, struct.error):
+        pass
+    return (0, 0, [])
+
+# index the records of a pcap file that haven't been indexed yet and return the index entries
+# returns None if the file can't be indexed
+def updatePcapIndex(fileName, bucketSecs=idxBucketSecs):
+    if compressMethod(fileName) != "":
+        return None
+    (idxSecs, indexedTo, entries) = readPcapIndex(fileName)
+    if (idxSecs != bucketSecs) or (indexedTo > os.path.getsize(fileName)):
+        # the index doesn't match the pcap file, start over
+        (indexedTo, entries) = (0, [])
+    if (indexedTo == os.path.getsize(fileName)) or (os.path.getsize(fileName) <= pcapFileHdrLen):
+        return entries
+    pcapFile = PcapFile(fileName)
+    try:
+        if indexedTo:
+            pcapFile.seek(indexedTo)
+        lastBucket = entries[-1][0] if entries else -1
+        newEntries = []
+        offset = pcapFile.offset
+        rec = pcapFile.readRec()
+        while rec:
+            bucket = int(rec[0]) - int(rec[0]) % bucketSecs
+            if bucket > lastBucket:
+                newEntries.append((bucket, offset))
+                lastBucket = bucket
+            offset = pcapFile.offset
+            rec = pcapFile.readRec()
+    finally:
+        pcapFile.close()
+    # append the new records before updating the header
+    with open(fileName+idxSuffix, "r+b" if indexedTo else "wb") as idxFile:
+        idxFile.seek(0, os.SEEK_END)
+        if idxFile.tell() == 0:
+            idxFile.write(idxHdr.pack(idxMagic, bucketSecs, 0))
+        idxFile.write("".join(idxRec.pack(*entry) for entry in newEntries))
+        idxFile.seek(0)
+        idxFile.write(idxHdr.pack(idxMagic, bucketSecs, offset))
+    return entries + newEntries
+
+# return the offset of the first record in a pcap file that may be at or after the specified time
+def indexOffset(entries, startTime):
+    i = bisect.bisect_right([entry[0] for entry in entries], startTime) - 1
+    if i < 0:
+        return pcapFileHdrLen
+    return entries[i][1]
+
+# return the source IP address and port, destination IP address and port, sequence number,
+# flags, and payload of a TCP packet, or None if it isn't an IPv4 TCP packet
+def tcpSegment(pkt):
+    try:
+        offset = etherHdrLen
+        (etherType,) = struct.unpack_from("!H", pkt, offset-2)
+        if etherType == etherTypeVlan:
+            offset += vlanTagLen
+            (etherType,) = struct.unpack_from("!H", pkt, offset-2)
+        if etherType != etherTypeIp:
+            return None
+        (verIhl, ipLen, proto, srcIp, dstIp) = ipHdr.unpack_from(pkt, offset)
+        if (verIhl >> 4 != 4) or (proto != ipProtoTcp):
+            return None
+        # the IP total length excludes any ethernet padding
+        ipEnd = min(offset + ipLen, len(pkt))
+        offset += (verIhl & 0x0f) * 4
+        (srcPort, dstPort, seq, dataOffset, flags) = tcpHdr.unpack_from(pkt, offset)
+        offset += (dataOffset >> 4) * 4
+    except struct.error:    # truncated packet
+        return None
+    return (srcIp, srcPort, dstIp, dstPort, seq, flags, buffer(pkt, offset, max(0, ipEnd - offset)))
+
+# signed difference between two TCP sequence numbers
+def seqDiff(seq1, seq2):
+    return ((seq1 - seq2 + 0x80000000) & 0xffffffff) - 0x80000000
+
+# one direction of a TCP connection
+class TcpStream(object):
+
+    def __init__(self, window=tcpWindow):
+        self.window = window
+        self.nextSeq = None
+        self.segments = {}      # out of order segments - seq: data
+        self.held = 0
+        self.duplicates = 0
+        self.lostBytes = 0
+
+    # add a segment and return the data that is now in order
+    def add(self, seq, flags, data):
+        if flags & tcpSyn:
+            self.nextSeq = (seq + 1) & 0xffffffff
+            self.segments.clear()
+            self.held = 0
+            seq = self.nextSeq
+        elif self.nextSeq is None:      # the capture started in the middle of the connection
+            self.nextSeq = seq
+        if len(data) == 0:
+            return []
+        diff = seqDiff(seq, self.nextSeq)
+        if diff > 0:
+            # hold data that arrived early until the gap is filled
+            if len(self.segments.get(seq, "")) < len(data):
+                self.held += len(data) - len(self.segments.get(seq, ""))
+                self.segments[seq] = str(data)
+            if self.held <= self.window:
+                return []
+            # the gap isn't going to be filled, skip it
+            nextSeq = min(self.segments.keys(), key=lambda s: seqDiff(s, self.nextSeq))
+            self.lostBytes += seqDiff(nextSeq, self.nextSeq)
+            self.nextSeq = nextSeq
+            return self.drain()
+        if len(data) <= -diff:          # retransmission of data that has already been seen
+            self.duplicates += 1
+            return []
+        chunks = [data[-diff:] if diff else data]
+        self.nextSeq = (seq + len(data)) & 0xffffffff
+        return chunks + self.drain()
+
+    # return the held data that is in order
+    def drain(self):
+        chunks = []
+        while self.segments:
+            seq = min(self.segments.keys(), key=lambda s: seqDiff(s, self.nextSeq))
+            diff = seqDiff(seq, self.nextSeq)
+            if diff > 0:
+                break
+            data = self.segments.pop(seq)
+            self.held -= len(data)
+            if len(data) > -diff:
+                chunks.append(data[-diff:])
+                self.nextSeq = (seq + len(data)) & 0xffffffff
+            else:
+                self.duplicates += 1
+        return chunks
+
+    # return all of the held data, skipping any gaps
+    def flush(self):
+        chunks = []
+        while self.segments:
+            nextSeq = min(self.segments.keys(), key=lambda s: seqDiff(s, self.nextSeq))
+            self.lostBytes += max(0, seqDiff(nextSeq, self.nextSeq))
+            self.nextSeq = nextSeq
+            chunks += self.drain()
+        return chunks
+
+# the TCP streams in a capture
+class TcpFlows(object):
+
+    def __init__(self, window=tcpWindow):
+        self.window = window
+        self.flows = {}
+        self.duplicates = 0
+        self.lostBytes = 0
+
+    # add a segment returned by tcpSegment and return the data of its flow that is now in order
+    def add(self, segment):
+        (srcIp, srcPort, dstIp, dstPort, seq, flags, data) = segment
+        flowKey = (srcIp, srcPort, dstIp, dstPort)
+        try:
+            stream = self.flows[flowKey]
+        except KeyError:
+            stream = self.flows[flowKey] = TcpStream(self.window)
+        chunks = stream.add(seq, flags, data)
+        if flags & (tcpFin | tcpRst):   # the connection is closed
+            chunks += self.remove(flowKey)
+        return chunks
+
+    # forget a flow and return the data that it is holding
+    def remove(self, flowKey):
+        stream = self.flows.pop(flowKey)
+        chunks = stream.flush()
+        self.duplicates += stream.duplicates
+        self.lostBytes += stream.lostBytes
+        return chunks
+
+    # forget all flows and return the data that they are holding in flow order
+    def flush(self):
+        return [(flowKey, self.remove(flowKey)) for flowKey in sorted(self.flows.keys())]
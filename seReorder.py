@@ -0,0 +1,94 @@
+# SolarEdge device data reordering
+
+# Backlog data from inverters and data merged from multiple sources can arrive out of
+# time order.  Device records are held in a heap ordered by the device time stamp and
+# released when they are older than the newest record by more than the window, or when
+# the number of records held exceeds the window.  Records are also released when they have
+# been held for longer than the window in seconds, or for maxHoldSecs if the window is a
+# number of records, so that the last records of a device that stops sending data are
+# written.  Records that arrive after a later record has been released are counted and
+# dropped.  Items of a message that aren't device records, such as the time a message was
+# captured when the input is a pcap file, are kept with each record and written with the
+# message it is released in.
+
+import collections
+import heapq
+import time
+from seConf import *
+
+devTypes = ["inverters", "optimizers", "events"]
+maxHoldSecs = 60
+
+class ReorderBuffer(object):
+
+    def __init__(self, windowSecs=0, windowRecords=0):
+        self.windowSecs = windowSecs
+        self.windowRecords = windowRecords
+        self.heap = []
+        self.seq = 0
+        self.newest = 0
+        self.lastReleased = 0
+        self.late = 0
+        self.timeStamps = {}
+        self.holdSecs = windowSecs if windowSecs else maxHoldSecs
+        self.arrivals = collections.deque()     # (arrival time, device time stamp)
+        self.heldUntil = 0      # records up to this device time have been held long enough
+
+    # convert a date and time to seconds since the epoch
+    def epochTime(self, dateStr, timeStr):
+        try:
+            return self.timeStamps[(dateStr, timeStr)]
+        except KeyError:
+            if len(self.timeStamps) > 100000:
+                self.timeStamps.clear()
+            timeStamp = int(time.mktime(time.strptime(dateStr+" "+timeStr, "%Y-%m-%d %H:%M:%S")))
+            self.timeStamps[(dateStr, timeStr)] = timeStamp
+            return timeStamp
+
+    # add the device records in a message and return messages containing the records that are ready
+    def add(self, msgDict):
+        now = time.time()
+        # items of the message that aren't device records, e.g. the capture time
+        msgItems = dict((key, value) for (key, value) in msgDict.items() if key not in devTypes)
+        for devType in devTypes:
+            for (seId, devDict) in msgDict.get(devType, {}).items():
+                timeStamp = self.epochTime(devDict["Date"], devDict["Time"])
+                if timeStamp < self.lastReleased:
+                    self.late += 1
+                    debug("debugEnable", "late", devType, seId, devDict["Date"], devDict["Time"])
+                    continue
+                self.seq += 1
+                heapq.heappush(self.heap, (timeStamp, self.seq, devType, seId, devDict, msgItems))
+                self.arrivals.append((now, timeStamp))
+                self.newest = max(self.newest, timeStamp)
+        return self.release(False)
+
+    # return messages containing the records that are ready, or all of them
+    def release(self, flush=True):
+        # a record that has been held too long is released along with the earlier ones
+        holdTime = time.time() - self.holdSecs
+        while self.arrivals and (self.arrivals[0][0] <= holdTime):
+            self.heldUntil = max(self.heldUntil, self.arrivals.popleft()[1])
+        if flush:
+            self.arrivals.clear()
+        msgs = []
+        msgDict = None
+        msgTypeIdx = 0
+        while self.heap and (flush or (self.heap[0][0] <= self.heldUntil) or
+                             (self.windowSecs and (self.heap[0][0] <= self.newest - self.windowSecs)) or
+                             (self.windowRecords and (len(self.heap) > self.windowRecords))):
+            (timeStamp, seq, devType, seId, devDict, msgItems) = heapq.heappop(self.heap)
+            # start a new message if this device is already in the current one, or if the
+            # current one contains a later device type, so that reading the records of each
+            # message in device type order keeps them in time order, or if the record came
+            # from a message with different message items
+            typeIdx = devTypes.index(devType)
+            if (msgDict is None) or (seId in msgDict[devType]) or (typeIdx < msgTypeIdx) or \
+               (any(msgDict.get(key) != value for (key, value) in msgItems.items())):
+                msgDict = dict((t, {}) for t in devTypes)
+                msgDict.update(msgItems)
+                msgs.append(msgDict)
+            msgDict[devType][seId] = devDict
+            msgTypeIdx = typeIdx
+            self.lastReleased = timeStamp
+        return msgs
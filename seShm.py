@@ -0,0 +1,192 @@
+# SolarEdge device state in shared memory
+
+# The state file is a fixed size memory mapped region that contains one slot
+# for each inverter and optimizer.  Slots are allocated in the order that
+# devices are first seen and the device ID is stored in the slot, so the slot
+# index of a device does not change when the writer is restarted.
+#
+# Each slot is protected by a sequence lock.  The writer sets the sequence
+# number to an odd value before updating the slot and to the next even value
+# after, so a slot that was left odd by a writer that stopped during an update
+# becomes even again the next time it is updated.  A reader retries if the
+# sequence number is odd or changes while the slot is being read.
+#
+# header:
+#   magic       4s  "SEST"
+#   version     H
+#   nFields     H   number of value fields in each slot
+#   nSlots      L   number of slots in the file
+#   nUsed       L   number of slots that have been allocated
+#
+# slot:
+#   seq         L   sequence lock
+#   devType     B   0=unused, 1=inverter, 2=optimizer
+#   ID          8s
+#   Date        10s
+#   Time        8s
+#   Inverter    8s  inverter ID (optimizers only)
+#   values      nFields d
+
+import mmap
+import os
+import struct
+import time
+
+from seDataParams import *
+
+shmMagic = "SEST"
+shmVersion = 1
+shmHdrFmt = "<4sHHLL"
+shmHdrLen = 64
+nUsedOffset = struct.calcsize(shmHdrFmt[:-1])
+defaultSlots = 4096
+readRetries = 1000
+
+devTypeInv = 1
+devTypeOpt = 2
+devTypeNames = {devTypeInv: "inverters", devTypeOpt: "optimizers"}
+
+# names and output formats of the value fields of each device type
+invFields = invItems[3:]
+invFieldFmts = invOutFmt[3:]
+optFields = optItems[4:]
+optFieldFmts = optOutFmt[4:]
+devFields = {devTypeInv: (invFields, invFieldFmts), devTypeOpt: (optFields, optFieldFmts)}
+nFields = max(len(invFields), len(optFields))
+
+slotBodyFmt = "<B3x8s10s8s8s%dd" % nFields
+slotBodyLen = struct.calcsize(slotBodyFmt)
+slotLen = (4 + slotBodyLen + 7) & ~7
+
+class SharedState(object):
+
+    def __init__(self, fileName, nSlots=defaultSlots, writer=False):
+        self.fileName = fileName
+        self.writer = writer
+        self.slotIdx = {}
+        self.slotBody = struct.Struct(slotBodyFmt)
+        if writer:
+            self.create(nSlots)
+        fd = os.open(fileName, os.O_RDWR if writer else os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            if writer:
+                self.mm = mmap.mmap(fd, size)
+            else:
+                self.mm = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        (magic, version, fields, self.nSlots, nUsed) = struct.unpack_from(shmHdrFmt, self.mm, 0)
+        if (magic != shmMagic) or (version != shmVersion) or (fields != nFields):
+            raise Exception("Invalid shared state file "+fileName)
+        self.scan()
+
+    # create the state file if it doesn't exist or has a different layout
+    def create(self, nSlots):
+        try:
+            with open(self.fileName, "rb") as stateFile:
+                (magic, version, fields, slots, nUsed) = struct.unpack(shmHdrFmt, stateFile.read(struct.calcsize(shmHdrFmt)))
+            if (magic == shmMagic) and (version == shmVersion) and (fields == nFields) and \
+               (os.path.getsize(self.fileName) == shmHdrLen + slots*slotLen):
+                return
+        except (IOError, struct.error):
+            pass
+        with open(self.fileName, "wb") as stateFile:
+            stateFile.write(struct.pack(shmHdrFmt, shmMagic, shmVersion, nFields, nSlots, 0).ljust(shmHdrLen, "\x00"))
+            stateFile.truncate(shmHdrLen + nSlots*slotLen)
+
+    # build the device ID to slot index from the allocated slots
+    def scan(self):
+        nUsed = self.nUsed()
+        for slot in range(len(self.slotIdx), nUsed):
+            seId = self.mm[self.slotOffset(slot)+8:self.slotOffset(slot)+16].rstrip("\x00")
+            self.slotIdx[seId] = slot
+
+    def nUsed(self):
+        return struct.unpack_from("<L", self.mm, nUsedOffset)[0]
+
+    def slotOffset(self, slot):
+        return shmHdrLen + slot*slotLen
+
+    def close(self):
+        self.mm.close()
+
+    # update the slot for a device, allocating one if it is new
+    def update(self, devType, devDict):
+        seId = str(devDict["ID"])
+        try:
+            slot = self.slotIdx[seId]
+            newSlot = False
+        except KeyError:
+            slot = self.nUsed()
+            if slot >= self.nSlots:
+                return False
+            newSlot = True
+        (fields, fmts) = devFields[devType]
+        values = [float(devDict.get(field, 0.0)) for field in fields]
+        values += [0.0]*(nFields-len(values))
+        offset = self.slotOffset(slot)
+        # the sequence number is odd if a writer stopped while updating the slot
+        seq = struct.unpack_from("<L", self.mm, offset)[0] | 1
+        struct.pack_into("<L", self.mm, offset, seq)
+        self.slotBody.pack_into(self.mm, offset+4, devType, str(seId), str(devDict.get("Date", "")), str(devDict.get("Time", "")),
+                                str(devDict.get("Inverter", "")), *values)
+        struct.pack_into("<L", self.mm, offset, (seq+1) & 0xffffffff)
+        if newSlot:
+            # the slot is complete before it becomes visible to readers
+            self.slotIdx[seId] = slot
+            struct.pack_into("<L", self.mm, nUsedOffset, slot+1)
+        return True
+
+    # return a consistent copy of a slot
+    def readSlot(self, slot):
+        offset = self.slotOffset(slot)
+        for retry in xrange(readRetries):
+            seq = struct.unpack_from("<L", self.mm, offset)[0]
+            if not seq & 1:
+                body = self.slotBody.unpack_from(self.mm, offset+4)
+                if struct.unpack_from("<L", self.mm, offset)[0] == seq:
+                    return body
+            time.sleep(0)
+        raise Exception("Unable to read slot %d" % slot)
+
+    # return the current values of a device as a dictionary
+    def readDevice(self, seId):
+        if seId not in self.slotIdx:
+            self.scan()
+        devDict = self.slotDict(self.readSlot(self.slotIdx[seId]))
+        devDict.pop("devType", None)
+        return devDict
+
+    # return the current values of all devices in the same form as the se2state file
+    def read(self):
+        self.scan()
+        stateDict = {"inverters": {}, "optimizers": {}}
+        for slot in range(len(self.slotIdx)):
+            devDict = self.slotDict(self.readSlot(slot))
+            if devDict:
+                stateDict[devTypeNames[devDict.pop("devType")]][devDict["ID"]] = devDict
+        return stateDict
+
+    def slotDict(self, body):
+        devType = body[0]
+        if devType not in devFields:
+            return {}
+        (fields, fmts) = devFields[devType]
+        devDict = {"devType": devType, "ID": body[1].rstrip("\x00"), "Date": body[2].rstrip("\x00"), "Time": body[3].rstrip("\x00")}
+        if devType == devTypeOpt:
+            devDict["Inverter"] = body[4].rstrip("\x00")
+        for i in range(len(fields)):
+            if fmts[i] == "%d":
+                devDict[fields[i]] = int(body[5+i])
+            else:
+                devDict[fields[i]] = body[5+i]
+        return devDict
+
+# open the state file for reading and return the current values of all devices
+def readState(fileName):
+    sharedState = SharedState(fileName)
+    try:
+        return sharedState.read()
+    finally:
+        sharedState.close()
@@ -0,0 +1,132 @@
+# SolarEdge synthetic performance data
+
+# Builds valid SolarEdge protocol messages containing performance data for a simulated
+# site of inverters and optimizers.  Values follow a daily solar production curve with
+# some noise, and a repeatable pseudo random sequence is used so that the same site
+# produces the same data every time.  Modules that import this one must reset sys.argv
+# before importing it because seConf parses the program arguments when it is imported.
+
+import math
+import random
+import struct
+import time
+from seMsg import *
+from seCommands import *
+from seDataParams import *
+
+# device types
+devTypeOpt = 0x0000
+devTypeInv = 0x0010
+devTypeNewOpt = 0x0080
+devTypeEvent = 0x0300
+
+serverAddr = 0xfffffffd
+invBaseId = 0x7f100000
+optBaseId = 0x10000000
+maxPostDevices = 100        # device records in each post
+newOptInterval = 4          # every 4th optimizer uses the new data format
+unused = 0xff7fffff         # value of unused inverter data items
+
+# a simulated site
+class Site(object):
+
+    def __init__(self, nInverters, nOptimizers, seed=0, firstInverter=invBaseId, firstOptimizer=optBaseId):
+        self.random = random.Random(seed)
+        self.inverters = [firstInverter + i for i in range(nInverters)]
+        self.optimizers = dict((inverter, []) for inverter in self.inverters)
+        for i in range(nOptimizers):
+            self.optimizers[self.inverters[i % nInverters]].append(firstOptimizer + i)
+        self.eday = dict((seId, 0.0) for seId in self.inverters + range(firstOptimizer, firstOptimizer + nOptimizers))
+        self.etot = dict((inverter, 1000000.0 * self.random.random()) for inverter in self.inverters)
+        self.startTime = 0
+        self.day = None
+
+    # fraction of the maximum power produced at a time of day
+    def sun(self, timeStamp):
+        hour = time.localtime(timeStamp).tm_hour + time.localtime(timeStamp).tm_min / 60.0
+        return max(0.0, math.sin(math.pi * (hour - 6) / 12)) * (0.9 + 0.1 * self.random.random())
+
+    # data of an inverter at a time
+    def invData(self, seId, timeStamp, interval):
+        pmax = 5000.0
+        pac = pmax * self.sun(timeStamp)
+        eac = pac * interval / 3600.0
+        self.eday[seId] += eac
+        self.etot[seId] += eac
+        vac = 240.0 + self.random.uniform(-2.0, 2.0)
+        return struct.pack(invInFmt, timeStamp, int(timeStamp - self.startTime), interval,
+                           30.0 + 10.0 * self.sun(timeStamp), self.eday[seId], eac, vac, pac / vac,
+                           50.0 + self.random.uniform(-0.05, 0.05), unused, unused,
+                           380.0 + self.random.uniform(-5.0, 5.0), unused, self.etot[seId], 0.0, unused,
+                           0.0, 0.0, pmax, 0.0, 0.0, unused, unused, pac, 0.0, unused)
+
+    # data of an optimizer in the original format at a time
+    def optData(self, seId, inverter, timeStamp, interval):
+        (vmod, vopt, imod, temp) = self.optValues(seId, timeStamp, interval)
+        return struct.pack(optInFmt, timeStamp, inverter, 0, int(timeStamp - self.startTime),
+                           vmod, vopt, imod, self.eday[seId], temp)
+
+    # data of an optimizer in the new format at a time
+    def newOptData(self, seId, timeStamp, interval):
+        (vmod, vopt, imod, temp) = self.optValues(seId, timeStamp, interval)
+        vmodBits = int(vmod / 0.125) & 0x3ff
+        voptBits = int(vopt / 0.125) & 0x3ff
+        imodBits = int(imod / 0.00625) & 0xfff
+        return struct.pack("<LHBBBBHb", timeStamp, int(timeStamp - self.startTime) & 0xffff,
+                           vmodBits & 0xff, (vmodBits >> 8) | ((voptBits & 0x3f) << 2),
+                           (voptBits >> 6) | ((imodBits & 0x0f) << 4), imodBits >> 4,
+                           int(self.eday[seId] / 0.25) & 0xffff, int(temp / 2))
+
+    def optValues(self, seId, timeStamp, interval):
+        sun = self.sun(timeStamp)
+        vmod = 30.0 + 8.0 * sun
+        imod = 8.0 * sun
+        self.eday[seId] += vmod * imod * interval / 3600.0
+        return (vmod, 40.0 * sun, imod, 20.0 + 20.0 * sun)
+
+    # a wake event for an inverter
+    def eventData(self, seId, timeStamp):
+        return struct.pack(eventInFmt, timeStamp, 0, timeStamp, timeStamp, 0, 0, 0)
+
+    # return the device records of each inverter at a time as a list of (inverter, [records])
+    def devices(self, timeStamp, interval=300):
+        day = time.localtime(timeStamp)[:3]
+        if day != self.day:
+            # start of a new day
+            if self.day is None:
+                self.startTime = timeStamp
+            self.day = day
+            for seId in self.eday.keys():
+                self.eday[seId] = 0.0
+            wake = True
+        else:
+            wake = False
+        invRecords = []
+        for inverter in self.inverters:
+            records = [devRecord(devTypeInv, inverter, self.invData(inverter, timeStamp, interval))]
+            for optimizer in self.optimizers[inverter]:
+                if optimizer % newOptInterval == 0:
+                    records.append(devRecord(devTypeNewOpt, optimizer, self.newOptData(optimizer, timeStamp, interval)))
+                else:
+                    records.append(devRecord(devTypeOpt, optimizer, self.optData(optimizer, inverter, timeStamp, interval)))
+            if wake:
+                records.append(devRecord(devTypeEvent, inverter, self.eventData(inverter, timeStamp)))
+            invRecords.append((inverter, records))
+        return invRecords
+
+    # return the posts sent by the inverters at a time as a list of (inverter, data, number of devices)
+    def posts(self, timeStamp, interval=300):
+        posts = []
+        for (inverter, records) in self.devices(timeStamp, interval):
+            for i in range(0, len(records), maxPostDevices):
+                posts.append((inverter, "".join(records[i:i+maxPostDevices]), len(records[i:i+maxPostDevices])))
+        return posts
+
+    # return the post messages sent by the inverters at a time as a list of (inverter, message, number of devices)
+    def postMsgs(self, timeStamp, msgSeq=0, interval=300):
+        return [(inverter, formatMsg((msgSeq + i) & 0xffff, inverter, serverAddr, PROT_CMD_SERVER_POST_DATA, data), nDevices)
+                for (i, (inverter, data, nDevices)) in enumerate(self.posts(timeStamp, interval))]
+
+# format a device record
+def devRecord(devType, seId, devData):
+    return struct.pack("<HLH", devType, seId, len(devData)) + devData
@@ -0,0 +1,213 @@
+#!/usr/bin/python
+
+# Measure the throughput of the stages of SolarEdge performance data processing
+#
+# Synthetic post messages are generated for each site size and processed by each stage:
+#
+#   readMsg          frame messages from a file in passive mode
+#   parseMsg         parse and validate message headers and checksums
+#   calcCrc          calculate message checksums
+#   parseDeviceData  decode device data
+#   writeData        write performance data in JSON format
+#
+# Each stage is run several times and the median frames per second, devices per second,
+# and memory allocated are reported, along with the spread of the times as a percentage of
+# the median.  Results can be saved as a baseline, and later results are compared with the
+# baseline to detect regressions.  A stage is only reported as slower if the difference is
+# more than both the tolerance and the spread that was measured, so that noisy stages
+# aren't reported.
+
+import gc
+import getopt
+import json
+import os
+import sys
+import tempfile
+import time
+
+# seConf parses the program arguments when it is imported
+benchArgs = sys.argv[1:]
+sys.argv = sys.argv[:1]
+
+from seSynth import *
+from seData import *
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# parameters
+siteSizes = [(1, 20), (5, 200), (20, 800), (50, 2000)]
+nPosts = 30
+repeats = 5
+baselineFileName = ""
+updateBaseline = False
+tolerance = 20      # percent
+startTime = 1483272000
+postInterval = 300
+
+# parse site sizes in the form invxopt,invxopt,...
+def parseSizes(opt):
+    try:
+        return [tuple(int(n) for n in size.split("x")) for size in opt.split(",")]
+    except ValueError:
+        print "Invalid site sizes", opt
+        sys.exit(1)
+
+# generate the post messages of a site
+def siteMsgs(nInverters, nOptimizers):
+    site = Site(nInverters, nOptimizers)
+    msgs = []
+    for i in range(nPosts):
+        msgs += site.postMsgs(startTime + i*postInterval, len(msgs))
+    return ([msg for (inverter, msg, nDevices) in msgs], sum(nDevices for (inverter, msg, nDevices) in msgs))
+
+# the measure of the memory allocated by a stage and its label
+# if tracemalloc isn't available, as in Python 2, the increase in the number of objects
+# tracked by the garbage collector while the stage runs is used
+if tracemalloc:
+    allocMeasure = "alloc KB"
+else:
+    allocMeasure = "gc objects"
+
+# run a stage and return the elapsed time, the memory allocated, and the result
+def measure(stage, *args):
+    if tracemalloc:
+        tracemalloc.start()
+    else:
+        gc.collect()
+        startObjects = len(gc.get_objects())
+    start = time.time()
+    result = stage(*args)
+    elapsed = time.time() - start
+    if tracemalloc:
+        alloc = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+    else:
+        alloc = len(gc.get_objects()) - startObjects
+    return (elapsed, alloc, result)
+
+# return the median of a list of numbers
+def median(values):
+    values = sorted(values)
+    mid = len(values) / 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid-1] + values[mid]) / 2.0
+
+# stages
+def benchReadMsg(frameFileName):
+    msgs = []
+    with open(frameFileName, "rb") as frameFile:
+        (msg, seq) = readMsg(frameFile, 0, None)    # skip data until the start of the first message
+        (msg, seq) = readMsg(frameFile, seq, None)
+        while msg != "":
+            msgs.append(msg)
+            (msg, seq) = readMsg(frameFile, seq, None)
+    return msgs
+
+def benchParseMsg(msgs):
+    return [parseMsg(msg) for msg in msgs]
+
+def benchCalcCrc(msgs):
+    crcs = []
+    for msg in msgs:
+        (dataLen, dataLenInv, msgSeq, fromAddr, toAddr, function) = struct.unpack("<HHHLLH", msg[0:msgHdrLen])
+        crcs.append(calcCrc(struct.pack(">HLLH", msgSeq, fromAddr, toAddr, function)+msg[msgHdrLen:msgHdrLen+dataLen]))
+    return crcs
+
+def benchParseDeviceData(parsedMsgs):
+    return [parseDeviceData(data) for (msgSeq, fromAddr, toAddr, function, data) in parsedMsgs]
+
+def benchWriteData(msgDicts):
+    with open(os.devnull, "w") as outFile:
+        outSeq = 0
+        for msgDict in msgDicts:
+            outSeq = writeData(msgDict, outFile, outSeq)
+    return outSeq
+
+# run the stages for a site size and return the results of each stage
+def benchSite(nInverters, nOptimizers):
+    (frames, nDevices) = siteMsgs(nInverters, nOptimizers)
+    (frameFd, frameFileName) = tempfile.mkstemp(prefix="sebench", suffix=".dat")
+    try:
+        with os.fdopen(frameFd, "wb") as frameFile:
+            # the magic number at the end marks the end of the last message
+            frameFile.write("".join(frames)+magic)
+        msgs = [frame[magicLen:] for frame in frames]
+        parsedMsgs = benchParseMsg(msgs)
+        msgDicts = benchParseDeviceData(parsedMsgs)
+        stages = [("readMsg", benchReadMsg, frameFileName),
+                  ("parseMsg", benchParseMsg, msgs),
+                  ("calcCrc", benchCalcCrc, msgs),
+                  ("parseDeviceData", benchParseDeviceData, parsedMsgs),
+                  ("writeData", benchWriteData, msgDicts),
+                  ]
+        results = {}
+        for (stageName, stage, stageInput) in stages:
+            runs = [measure(stage, stageInput) for i in range(repeats)]
+            times = [max(elapsed, 1e-9) for (elapsed, alloc, result) in runs]
+            elapsed = median(times)
+            results[stageName] = {"framesPerSec": len(frames) / elapsed,
+                                  "devicesPerSec": nDevices / elapsed,
+                                  "spreadPct": 100 * (max(times) - min(times)) / elapsed,
+                                  "alloc": runs[0][1],
+                                  "allocMeasure": allocMeasure}
+        return results
+    finally:
+        os.remove(frameFileName)
+
+# compare the medians with the baseline and return a list of regressions
+# the allowed slowdown is the tolerance or the spread of the times, whichever is larger
+def compareBaseline(results, baseline):
+    regressions = []
+    for key in sorted(results.keys()):
+        if key in baseline:
+            ratio = results[key]["framesPerSec"] / baseline[key]["framesPerSec"]
+            allowed = max(tolerance, results[key]["spreadPct"], baseline[key].get("spreadPct", 0))
+            if ratio < 1 - allowed / 100.0:
+                regressions.append((key, ratio))
+    return regressions
+
+if __name__ == "__main__":
+    # get program arguments and options
+    (opts, args) = getopt.getopt(benchArgs, "b:n:r:s:t:u")
+    for opt in opts:
+        if opt[0] == "-b":
+            baselineFileName = opt[1]
+        elif opt[0] == "-n":
+            nPosts = int(opt[1])
+        elif opt[0] == "-r":
+            repeats = int(opt[1])
+        elif opt[0] == "-s":
+            siteSizes = parseSizes(opt[1])
+        elif opt[0] == "-t":
+            tolerance = float(opt[1])
+        elif opt[0] == "-u":
+            updateBaseline = True
+    if updateBaseline and (baselineFileName == ""):
+        print "Baseline file must be specified"
+        sys.exit(1)
+    results = {}
+    print "%-12s %-16s %12s %14s %8s %10s" % ("site", "stage", "frames/sec", "devices/sec", "spread", allocMeasure)
+    for (nInverters, nOptimizers) in siteSizes:
+        siteName = "%dx%d" % (nInverters, nOptimizers)
+        siteResults = benchSite(nInverters, nOptimizers)
+        for stageName in ["readMsg", "parseMsg", "calcCrc", "parseDeviceData", "writeData"]:
+            result = siteResults[stageName]
+            results[siteName+"/"+stageName] = result
+            print "%-12s %-16s %12.1f %14.1f %7.1f%% %10s" % (siteName, stageName, result["framesPerSec"],
+                                                             result["devicesPerSec"], result["spreadPct"],
+                                                             result["alloc"])
+    if baselineFileName != "":
+        if updateBaseline:
+            with open(baselineFileName, "w") as baselineFile:
+                json.dump(results, baselineFile, indent=1, sort_keys=True)
+        else:
+            with open(baselineFileName) as baselineFile:
+                regressions = compareBaseline(results, json.load(baselineFile))
+            for (key, ratio) in regressions:
+                print "regression:", key, "%.0f%% of baseline" % (ratio * 100)
+            if regressions:
+                sys.exit(1)
@@ -0,0 +1,292 @@
+#!/usr/bin/python
+
+# Stand-in MQTT broker for testing se2MQTT
+#
+# The broker accepts MQTT connections, acknowledges connections and QoS 1 messages, and
+# counts the messages that are published.  It can delay acknowledgements, and it can close
+# the connection after a number of messages and refuse connections for a time so that
+# reconnection and the spill file can be tested.
+#
+# If a file of performance data is specified, se2MQTT is started with its output sent to
+# the broker and the lines of the file are written to its input.  The Uptime of each
+# inverter is replaced by the line number, a sequence number that is unique to the line, so
+# that each message can be matched with the line it was published for.  A message that
+# contains the state of all the inverters was published for the latest line of the
+# inverters in it, and a message on the topic of a single inverter was published for the
+# line of that inverter.  A message is a duplicate if a message on the same topic was
+# already received for its line.  When all the lines have been published or no messages
+# have been received for the timeout, the message rate, the latency from writing a line to
+# receiving its message, and the numbers of lines that were lost, published more than once,
+# or published out of order are reported.
+
+import collections
+import getopt
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+# parameters
+brokerAddr = "localhost"
+brokerPort = 1883
+ackDelay = 0.0
+closeAfter = 0          # close the connection after this many messages
+downSecs = 0.0          # refuse connections for this long after closing the connection
+lineInterval = 0.0
+timeout = 10.0
+clientOpts = ""
+inFileName = ""
+recvSize = 4096
+
+# MQTT packet types
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+connRefused = 3         # server unavailable
+
+# results
+stats = collections.Counter()
+sendTimes = {}          # line number: time the line was written
+recvTimes = {}          # line number: time its first message was received
+recvMsgs = set()        # (line number, topic) of the messages that have been received
+lastSeq = 0             # highest line number received
+lastRecv = time.time()  # time the last message was received
+downUntil = 0           # time until which connections are refused
+statsLock = threading.Lock()
+
+def count(name, n=1):
+    with statsLock:
+        stats[name] += n
+
+# read a packet from a connection, returns (type, flags, data, the rest of the input)
+# acks that become due while waiting for input are sent
+def recvPacket(conn, inBuf, pendingAcks):
+    while True:
+        if len(inBuf) >= 2:
+            # the remaining length is encoded in up to 4 bytes
+            (length, multiplier, pos) = (0, 1, 1)
+            while pos < len(inBuf):
+                byte = ord(inBuf[pos])
+                length += (byte & 0x7f) * multiplier
+                multiplier *= 128
+                pos += 1
+                if byte & 0x80 == 0:
+                    if len(inBuf) >= pos+length:
+                        header = ord(inBuf[0])
+                        return (header >> 4, header & 0x0f, inBuf[pos:pos+length], inBuf[pos+length:])
+                    break
+        sendAcks(conn, pendingAcks)
+        conn.settimeout(max(pendingAcks[0][0] - time.time(), .001) if pendingAcks else None)
+        try:
+            data = conn.recv(recvSize)
+        except socket.timeout:
+            continue
+        if data == "":
+            raise socket.error("connection closed")
+        inBuf += data
+
+# send a packet with a length of less than 128
+def sendPacket(conn, packetType, data):
+    conn.sendall(chr(packetType << 4)+chr(len(data))+data)
+
+# send the acks that are due
+# pendingAcks is a deque of (time the ack is due, packet ID)
+def sendAcks(conn, pendingAcks):
+    while pendingAcks and (pendingAcks[0][0] <= time.time()):
+        sendPacket(conn, PUBACK, pendingAcks.popleft()[1])
+
+# record the line number that a message was published for
+def recordMsg(msgTopic, payload, recvTime):
+    global lastSeq
+    try:
+        msgDict = json.loads(payload)
+    except ValueError:
+        count("badPayloads")
+        return
+    if "/inverters/" in msgTopic:
+        seq = msgDict.get("Uptime")
+    elif msgDict.get("inverters"):
+        # the state of all the inverters is published for the latest line
+        seq = max(devDict.get("Uptime") for devDict in msgDict["inverters"].values())
+    else:
+        return
+    with statsLock:
+        if seq not in sendTimes:
+            return
+        if (seq, msgTopic) in recvMsgs:
+            stats["duplicates"] += 1
+            return
+        recvMsgs.add((seq, msgTopic))
+        if seq in recvTimes:
+            return
+        if seq < lastSeq:
+            stats["outOfOrder"] += 1
+        lastSeq = max(lastSeq, seq)
+        recvTimes[seq] = recvTime
+
+# close a connection after sending the acks that are due
+# the input that hasn't been read is discarded before the connection is closed, otherwise the
+# connection is reset and the client may lose the acks that were sent
+def closeClient(conn, pendingAcks):
+    sendAcks(conn, pendingAcks)
+    conn.shutdown(socket.SHUT_WR)
+    conn.settimeout(timeout)
+    while conn.recv(recvSize) != "":
+        pass
+
+# handle a client connection
+def serveClient(conn):
+    global lastRecv, downUntil
+    inBuf = ""
+    nMsgs = 0
+    pendingAcks = collections.deque()
+    try:
+        while True:
+            (packetType, flags, data, inBuf) = recvPacket(conn, inBuf, pendingAcks)
+            if packetType == CONNECT:
+                if time.time() < downUntil:
+                    count("refused")
+                    sendPacket(conn, CONNACK, "\x00"+chr(connRefused))
+                    return
+                count("connections")
+                sendPacket(conn, CONNACK, "\x00\x00")
+            elif packetType == PUBLISH:
+                recvTime = time.time()
+                topicLen = struct.unpack(">H", data[:2])[0]
+                msgTopic = data[2:2+topicLen]
+                qos = (flags >> 1) & 3
+                pos = 2+topicLen
+                if qos > 0:
+                    packetId = data[pos:pos+2]
+                    pos += 2
+                count("messages")
+                count("bytes", len(data))
+                lastRecv = recvTime
+                recordMsg(msgTopic, data[pos:], recvTime)
+                nMsgs += 1
+                if closeAfter and (nMsgs >= closeAfter):
+                    # close without acknowledging the message, so it should be sent again
+                    count("closed")
+                    downUntil = time.time() + downSecs
+                    closeClient(conn, pendingAcks)
+                    return
+                if qos > 0:
+                    # delay the ack without delaying the messages that follow
+                    pendingAcks.append((recvTime + ackDelay, packetId))
+                    sendAcks(conn, pendingAcks)
+            elif packetType == SUBSCRIBE:
+                sendPacket(conn, SUBACK, data[:2]+"\x00")
+            elif packetType == PINGREQ:
+                sendPacket(conn, PINGRESP, "")
+            elif packetType == DISCONNECT:
+                return
+    except socket.error:
+        pass
+    finally:
+        conn.close()
+
+# accept connections
+def serveBroker(sock):
+    while True:
+        (conn, addr) = sock.accept()
+        clientThread = threading.Thread(name="client thread", target=serveClient, args=(conn,))
+        clientThread.daemon = True
+        clientThread.start()
+
+# start se2MQTT and write the lines of a file to it
+def runClient(inFileName):
+    client = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "se2MQTT.py"),
+                               "-s", "%s:%d" % (brokerAddr, brokerPort), "-t", "sebroker"] + clientOpts.split(),
+                              stdin=subprocess.PIPE)
+    seq = 0
+    with open(inFileName) as inFile:
+        for line in inFile:
+            if line.strip() == "":
+                continue
+            seq += 1
+            inDict = json.loads(line)
+            for devDict in inDict["inverters"].values():
+                devDict["Uptime"] = seq
+            with statsLock:
+                sendTimes[seq] = time.time()
+            client.stdin.write(json.dumps(inDict)+"\n")
+            client.stdin.flush()
+            time.sleep(lineInterval)
+    # wait for the messages
+    while True:
+        with statsLock:
+            if len(recvTimes) == len(sendTimes):
+                break
+        if time.time() - max(lastRecv, sendTimes.get(seq, 0)) > timeout:
+            break
+        time.sleep(.1)
+    client.kill()
+    client.wait()
+
+# return the value at a percentile of a sorted list
+def percentile(values, pct):
+    return values[min(len(values)-1, int(len(values) * pct / 100.0))]
+
+# print the results
+def report(elapsed):
+    print "%-21s" % "elapsed secs:", "%.1f" % elapsed
+    for name in ["connections", "refused", "closed", "messages", "bytes", "badPayloads"]:
+        print "%-21s" % (name+":"), stats[name]
+    print "%-21s" % "messages/sec:", "%.1f" % (stats["messages"] / max(elapsed, 1e-9))
+    if sendTimes:
+        print "%-21s" % "lines:", len(sendTimes)
+        print "%-21s" % "lost:", len(sendTimes) - len(recvTimes)
+        print "%-21s" % "duplicates:", stats["duplicates"]
+        print "%-21s" % "outOfOrder:", stats["outOfOrder"]
+        values = sorted(recvTimes[seq] - sendTimes[seq] for seq in recvTimes.keys())
+        if values:
+            print "latency ms:           p50 %.1f p90 %.1f p99 %.1f max %.1f" % tuple(1000 * v for v in
+                [percentile(values, 50), percentile(values, 90), percentile(values, 99), values[-1]])
+
+if __name__ == "__main__":
+    # get program arguments and options
+    (opts, args) = getopt.getopt(sys.argv[1:], "a:c:d:i:o:p:t:")
+    for opt in opts:
+        if opt[0] == "-a":
+            ackDelay = float(opt[1])
+        elif opt[0] == "-c":
+            closeAfter = int(opt[1])
+        elif opt[0] == "-d":
+            downSecs = float(opt[1])
+        elif opt[0] == "-i":
+            lineInterval = float(opt[1])
+        elif opt[0] == "-o":
+            clientOpts = opt[1]
+        elif opt[0] == "-p":
+            brokerPort = int(opt[1])
+        elif opt[0] == "-t":
+            timeout = float(opt[1])
+    if args:
+        inFileName = args[0]
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((brokerAddr, brokerPort))
+    sock.listen(5)
+    brokerThread = threading.Thread(name="broker thread", target=serveBroker, args=(sock,))
+    brokerThread.daemon = True
+    brokerThread.start()
+    startTime = time.time()
+    try:
+        if inFileName != "":
+            runClient(inFileName)
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    report(time.time() - startTime)
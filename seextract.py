@@ -2,6 +2,17 @@
 
 # Read a PCAP file that is a capture of the traffic between a SolarEdge inverter and the SE server.
 # Filter out the TCP stream between the inverter to the server.
+# The TCP segments are reassembled in sequence number order and retransmitted data is
+# removed.  The stream from the server to the inverter may be written to a separate file.
+# Multiple pcap files may be extracted in parallel, in which case each process parses the
+# packets of one file and writes the TCP segments to or from the server to a temporary file
+# along with the time stamps of the packets.  The temporary files are merged in time stamp
+# order and the segments are reassembled in one set of streams, as they are when the files
+# are read sequentially, so that retransmissions and reordering across files are handled.
+# A packet that has the same time stamp and contents as one in an earlier file is skipped,
+# so that the data in overlapping captures is only written once.
+# A time index of each pcap file can be maintained so the records in a time range can be
+# found without reading the file from the beginning.
 
 import os
 import socket
@@ -10,6 +21,12 @@ import sys
 import time
 import getopt
 import syslog
+import heapq
+import multiprocessing
+import shutil
+import tempfile
+
+from sePcap import *
 
 # configuration
 debug = False
@@ -22,85 +39,180 @@ seIpAddr = 0
 pcapDir = ""
 pcapFiles = []
 pcapFileName = ""
-pcapSeq = 0
 outFileName = ""
+respFileName = ""
 follow = False
 writeMode = "w"
 sleepInterval = 10
+sePort = 22222
+outBufSize = 1024*1024
+jobs = 0
+indexing = False
+startTime = 0
+endTime = 2**62
+
+# temporary file record header - time stamp, source IP, source port, destination IP,
+# destination port, sequence number, flags, data length
+tempRecHdr = struct.Struct("<dLHLHLBL")
+tempDir = None      # directory of the temporary files
 
 # file handles
 pcapFile = None
 outFile = None
+respFile = None
+tempFile = None
+
+# TCP streams
+tcpFlows = TcpFlows()
 
-# file constants
-pcapFileHdrLen = 24
-pcapRecHdrLen = 16
-etherHdrLen = 14
-ipHdrLen = 20
-tcpHdrLen = 20
-
-# PCAP file header
-def readPcapFileHdr(pcapFile):
-    return struct.unpack("<LHHLLLL", pcapFile.read(pcapFileHdrLen))
-
-# PCAP record header
-def readPcapRecHdr(pcapFile):
-    pcapBuf = pcapFile.read(pcapRecHdrLen)
-    if pcapBuf:
-        return struct.unpack("<LLLL", pcapBuf)
-    else:
-        return None
 # PCAP record
-def readPcapRec(pcapFile):
-    global pcapSeq, debugData
-    pcapSeq += 1
+def readPcapRec(timeStamp, pkt):
+    global debugData
     # if sequence numbers were specified turn debugData on or off
     if debugSeq != []:
-        if pcapSeq in debugSeq: debugData = True
-        else:                   debugData = False
-    pcapRecLen = pcapRec[2]
+        if pcapFile.seq in debugSeq: debugData = True
+        else:                        debugData = False
     # strip off ethernet, IP, and TCP headers
-    etherHdr = readEtherHdr(pcapFile)
-    ipHdr = readIpHdr(pcapFile)
-    tcpHdr = readTcpHdr(pcapFile)
-    # data is whatever is left
-    dataLen = pcapRecLen - etherHdrLen - ipHdrLen - tcpHdrLen
-    if debugData: log("pcap", "pcapSeq", pcapSeq, "srcIp", ip2str(ipHdr[3]), "dstIp", ip2str(ipHdr[4]), "pcapRecLen", pcapRecLen, "dataLen", dataLen)
-    if dataLen > 0:
-        if (seIpAddr == 0) or (ipHdr[4] == seIpAddr):   # only process records where IP dest is SE server
-            if outFile:
-                outFile.write(pcapFile.read(dataLen))
-            else:
-                sys.stdout.write(pcapFile.read(dataLen))
-                sys.stdout.flush()
-        else:   # ? FIXME
-            pcapFile.read(dataLen)
-
-# Ethernet header    
-def readEtherHdr(pcapFile):
-    return pcapFile.read(etherHdrLen)
-
-# IP header
-def readIpHdr(pcapFile):
-    return struct.unpack("!LLLLL", pcapFile.read(ipHdrLen))
-    
-# TCP header
-def readTcpHdr(pcapFile):
-    return struct.unpack("<LLLLL", pcapFile.read(tcpHdrLen))
+    segment = tcpSegment(pkt)
+    if not segment:
+        return
+    (srcIp, srcPort, dstIp, dstPort, seq, flags, data) = segment
+    if debugData: log("pcap", "pcapSeq", pcapFile.seq, "srcIp", ip2str(srcIp), "dstIp", ip2str(dstIp), "seq", seq, "pcapRecLen", len(pkt), "dataLen", len(data))
+    stream = segmentStream(srcIp, srcPort, dstIp, dstPort)
+    if stream is not None:
+        if tempFile:
+            # the segments are reassembled when the temporary files are merged
+            tempFile.write(tempRecHdr.pack(timeStamp, srcIp, srcPort, dstIp, dstPort, seq, flags, len(data)))
+            tempFile.write(data)
+        else:
+            writeStream(stream, timeStamp, tcpFlows.add(segment))
+
+# return the stream that the data from a source to a destination is written to
+# 0 = inverter to server, 1 = server to inverter, None = not written
+def segmentStream(srcIp, srcPort, dstIp, dstPort):
+    if seIpAddr != 0:
+        toServer = (dstIp == seIpAddr)
+        fromServer = (srcIp == seIpAddr)
+    else:
+        toServer = (dstPort == sePort)
+        fromServer = (srcPort == sePort)
+    if toServer:
+        return 0
+    elif fromServer and (respFileName != ""):
+        return 1
+    return None
+
+# write data to the file for its stream
+def writeStream(stream, timeStamp, chunks):
+    outStream = [outFile, respFile][stream]
+    for chunk in chunks:
+        outStream.write(chunk)
+
+# read the records in the current pcap file and return the last time stamp
+def readPcapFile():
+    timeStamp = 0
+    for (timeStamp, pkt) in pcapFile.records():
+        if timeStamp < startTime:
+            continue
+        if timeStamp >= endTime:
+            break
+        readPcapRec(timeStamp, pkt)
+    return timeStamp
+
+# update the index of the current pcap file and position it at the start of the time range
+def seekPcapFile():
+    if indexing or (startTime > 0):
+        entries = updatePcapIndex(pcapFile.fileName)
+        if entries and (startTime > 0):
+            pcapFile.seek(indexOffset(entries, startTime))
+
+# write the data that is being held for incomplete streams
+def flushStreams(timeStamp):
+    for ((srcIp, srcPort, dstIp, dstPort), chunks) in tcpFlows.flush():
+        writeStream(segmentStream(srcIp, srcPort, dstIp, dstPort), timeStamp, chunks)
+    if debugFiles: log("retransmissions:", tcpFlows.duplicates, "lost bytes:", tcpFlows.lostBytes)
+
+# extract the TCP segments in a pcap file to a temporary file in a separate process
+# returns the name of the temporary file and an error message
+def extractFile(fileName):
+    global pcapFile, tempFile
+    try:
+        if debugFiles: log("reading", fileName)
+        pcapFile = PcapFile(fileName)
+        seekPcapFile()
+    except Exception:
+        return (None, "Unable to open "+fileName)
+    (tempFd, tempFileName) = tempfile.mkstemp(prefix="seextract", suffix=".tmp", dir=tempDir)
+    tempFile = os.fdopen(tempFd, "wb", outBufSize)
+    try:
+        readPcapFile()
+    finally:
+        tempFile.close()
+        closePcapFile()
+    return (tempFileName, "")
+
+# read the segments in a temporary file
+def readTempFile(tempFileName, fileIdx):
+    with open(tempFileName, "rb", outBufSize) as inFile:
+        recHdr = inFile.read(tempRecHdr.size)
+        while recHdr:
+            (timeStamp, srcIp, srcPort, dstIp, dstPort, seq, flags, dataLen) = tempRecHdr.unpack(recHdr)
+            yield (timeStamp, fileIdx, (srcIp, srcPort, dstIp, dstPort, seq, flags, inFile.read(dataLen)))
+            recHdr = inFile.read(tempRecHdr.size)
+
+# extract pcap files in parallel and reassemble the segments in time stamp order
+# the temporary files are written in a directory that is removed when the extraction ends,
+# so that the files of workers whose results weren't received are also removed
+def extractFiles(fileNames):
+    global tempDir
+    tempFileNames = []
+    # the directory must be created before the worker processes
+    tempDir = tempfile.mkdtemp(prefix="seextract")
+    pool = None
+    try:
+        pool = multiprocessing.Pool(jobs)
+        for (tempFileName, errorMsg) in pool.imap(extractFile, fileNames):
+            if errorMsg != "":
+                terminate(1, errorMsg)
+            tempFileNames.append(tempFileName)
+        pool.close()
+        timeStamp = 0
+        seen = {}   # segments at the current time stamp - segment: index of the file it was in
+        for (segTime, fileIdx, segment) in heapq.merge(*[readTempFile(tempFileName, fileIdx)
+                                                         for (fileIdx, tempFileName) in enumerate(tempFileNames)]):
+            if segTime != timeStamp:
+                seen.clear()
+                timeStamp = segTime
+            # skip a packet that is also in an earlier file of overlapping captures
+            if seen.setdefault(segment, fileIdx) != fileIdx:
+                continue
+            (srcIp, srcPort, dstIp, dstPort, seq, flags, data) = segment
+            writeStream(segmentStream(srcIp, srcPort, dstIp, dstPort), timeStamp, tcpFlows.add(segment))
+        flushStreams(timeStamp)
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+        shutil.rmtree(tempDir, True)
+
+# list the pcap files in a directory in name order, excluding index files
+def listPcapFiles(pcapDir):
+    return sorted(fileName for fileName in os.listdir(pcapDir) if not fileName.endswith(idxSuffix))
 
 # get command line options and arguments
 def getOpts():
     global debug, debugFiles, debugRecs, debugData
-    global writeMode, follow
-    global outFileName
+    global writeMode, follow, jobs
+    global indexing, startTime, endTime
+    global outFileName, respFileName
     global seHostName, seIpAddr
     global pcapDir, pcapFileName, pcapFiles
-    (opts, args) = getopt.getopt(sys.argv[1:], "afo:s:v")
+    (opts, args) = getopt.getopt(sys.argv[1:], "afij:o:r:s:v", ["from=", "to="])
     try:
         pcapFileName = args[0]
         if os.path.isdir(pcapFileName): # a directory was specified
             pcapDir = pcapFileName.strip("/")+"/"
-            pcapFiles = os.listdir(pcapDir)
+            pcapFiles = listPcapFiles(pcapDir)
         else:                           # a file was specified
             pcapDir = ""
             pcapFiles = [pcapFileName]       
@@ -111,8 +223,18 @@ def getOpts():
             writeMode = "a"
         elif opt[0] == "-f":
             follow = True
+        elif opt[0] == "-i":
+            indexing = True
+        elif opt[0] == "--from":
+            startTime = parseTime(opt[1])
+        elif opt[0] == "--to":
+            endTime = parseTime(opt[1])
+        elif opt[0] == "-j":
+            jobs = int(opt[1])
         elif opt[0] == "-o":
             outFileName = opt[1]
+        elif opt[0] == "-r":
+            respFileName = opt[1]
         elif opt[0] == "-s":
             seHostName = opt[1]
         elif opt[0] == "-v":
@@ -128,10 +250,15 @@ def getOpts():
         log("debugFiles:", debugFiles)  
         log("debugData:", debugData)
         log("follow:", follow)
+        log("jobs:", jobs)
+        log("indexing:", indexing)
+        log("startTime:", startTime)
+        log("endTime:", endTime)
         log("server:", seHostName)
         log("append:", writeMode)
         log("pcapFileName:", pcapFileName)
         log("outFileName:", outFileName)
+        log("respFileName:", respFileName)
     # get the IP address of the SolarEdge server
     try:
         if seHostName != "":    
@@ -140,30 +267,49 @@ def getOpts():
     except:
         print "Unable to resolve hostname", seHostName        
 
-# open the output file if it is specified
+# parse a time option
+def parseTime(timeStr):
+    for timeFmt in ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"]:
+        try:
+            return int(time.mktime(time.strptime(timeStr, timeFmt)))
+        except ValueError:
+            pass
+    try:
+        return int(timeStr)
+    except ValueError:
+        terminate(1, "Invalid time "+timeStr)
+
+# open the output files
 def openOutFile():
-    global outFile
+    global outFile, respFile
     if outFileName != "":
         try:
             if debugFiles: log("writing", outFileName)
-            outFile = open(outFileName, writeMode)
+            outFile = open(outFileName, writeMode, outBufSize)
         except:
             terminate(1, "Unable to open "+outFileName)
+    else:
+        outFile = os.fdopen(sys.stdout.fileno(), "w", outBufSize)
+    if respFileName != "":
+        try:
+            if debugFiles: log("writing", respFileName)
+            respFile = open(respFileName, writeMode, outBufSize)
+        except:
+            terminate(1, "Unable to open "+respFileName)
 
 # open the specified pcap file
 def openPcapFile(pcapFileName):
-    global pcapFile, pcapSeq
+    global pcapFile
     try:
         if debugFiles: log("opening", pcapFileName)
-        pcapFile = open(pcapFileName)
-        pcapHdr = readPcapFileHdr(pcapFile) # ignore the pcap file header
-        pcapSeq = 0
+        pcapFile = PcapFile(pcapFileName, follow)
+        seekPcapFile()
     except:
         terminate(1, "Unable to open "+pcapFileName)
 
 # close the currently open pcap file
 def closePcapFile():
-    if debugFiles: log("closing", pcapFileName, pcapSeq, "records")
+    if debugFiles: log("closing", pcapFile.fileName, pcapFile.seq, "records")
     pcapFile.close()
 
 # open the last modified file in the pcap directory
@@ -171,7 +317,7 @@ def openLastPcapFile():
     global pcapFileName, pcapDir, pcapFile
     if pcapDir != "":   # directory was specified
         try:
-            pcapFiles = os.listdir(pcapDir)
+            pcapFiles = listPcapFiles(pcapDir)
         except:
             terminate(1, "Unable to access directory "+pcapDir)
         latestModTime = 0
@@ -194,6 +340,7 @@ def openLastPcapFile():
 def closeFiles():
     if pcapFile: pcapFile.close()
     if outFile: outFile.close()
+    if respFile: respFile.close()
 
 def log(*args):
     message = args[0]+" "
@@ -218,20 +365,23 @@ if __name__ == "__main__":
         # open the latest pcap file in the pcap directory   
         openLastPcapFile()
         while True: # read forever
-            pcapRec = readPcapRecHdr(pcapFile)
-            if pcapRec:
-                readPcapRec(pcapFile)
-            else:   # end of file - wait a bit and see if there is more data
-                time.sleep(sleepInterval)
-                openLastPcapFile()
+            readPcapFile()
+            # end of file - wait a bit and see if there is more data
+            if indexing:
+                updatePcapIndex(pcapFile.fileName)
+            outFile.flush()
+            if respFile: respFile.flush()
+            time.sleep(sleepInterval)
+            openLastPcapFile()
+    elif jobs:      # not following - extract the files in parallel and exit
+        extractFiles([pcapDir+fileName for fileName in pcapFiles])
+        closeFiles()
     else:       # not following - process whatever files were specified and exit 
+        timeStamp = 0
         for pcapFileName in pcapFiles:
             if debugFiles: log("reading", pcapDir+pcapFileName)
             openPcapFile(pcapDir+pcapFileName)
-            pcapRec = readPcapRecHdr(pcapFile)
-            pcapSeq = 0
-            while pcapRec:
-                readPcapRec(pcapFile)
-                pcapRec = readPcapRecHdr(pcapFile)
+            timeStamp = readPcapFile()
             closePcapFile()
+        flushStreams(timeStamp)
         closeFiles()
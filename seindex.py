@@ -0,0 +1,246 @@
+#!/usr/bin/python
+
+# Index SolarEdge performance data files by time and device ID and query them
+#
+# The index of a file is written to a sidecar file with the same name followed by
+# .idx.  The first line of the index is a JSON object that summarizes the file:
+#
+#   {"end": offset of the end of the last indexed line, "first": earliest time,
+#    "last": latest time, "entries": number of lines}
+#
+# The second line is a JSON object that maps each device ID to the entries of the lines
+# that contain it, and each following line is the entry of one line of the data file:
+#
+#   [offset, length, first time, last time]
+#
+# Times are seconds since the epoch.  A query reads the summary first and skips the file
+# if it is outside the time range, then reads the device map if devices are requested
+# instead of all the entries.  Indexes are only written by the update step, which indexes
+# the lines after the end of the last indexed line and replaces the index file, so a file
+# that is being written to can be reindexed cheaply.  A query reads any lines after the
+# end of the index from the data file.  Offsets in compressed files are offsets in the
+# decompressed data, and compressed files are indexed once because they don't grow.
+
+import getopt
+import json
+import os
+import sys
+import time
+
+from seCompress import *
+
+# parameters
+query = False
+update = False
+following = False
+seIds = set()
+startTime = 0
+endTime = 2**62
+wholeLines = False
+sleepInterval = 10
+idxSuffix = ".idx"
+
+# cached time stamps
+timeStamps = {}
+
+# convert a date and time to seconds since the epoch
+def epochTime(dateStr, timeStr):
+    try:
+        return timeStamps[(dateStr, timeStr)]
+    except KeyError:
+        if len(timeStamps) > 100000:
+            timeStamps.clear()
+        timeStamp = int(time.mktime(time.strptime(dateStr+" "+timeStr, "%Y-%m-%d %H:%M:%S")))
+        timeStamps[(dateStr, timeStr)] = timeStamp
+        return timeStamp
+
+# parse a time option
+def parseTime(timeStr):
+    for timeFmt in ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"]:
+        try:
+            return int(time.mktime(time.strptime(timeStr, timeFmt)))
+        except ValueError:
+            pass
+    return int(timeStr)
+
+# create an index entry for a line of data, returns the entry and the device IDs
+def indexLine(offset, line):
+    msgDict = json.loads(line)
+    times = []
+    ids = []
+    for devType in ["inverters", "optimizers", "events"]:
+        for (seId, devDict) in msgDict.get(devType, {}).items():
+            ids.append(seId)
+            try:
+                times.append(epochTime(devDict["Date"], devDict["Time"]))
+            except KeyError:
+                pass
+    if times == []:
+        times = [0]
+    return ([offset, len(line), min(times), max(times)], ids)
+
+# return True if the summary of an index matches the data file
+def indexCurrent(dataFileName, summary):
+    if compressMethod(dataFileName) != "":
+        return os.path.getmtime(dataFileName+idxSuffix) >= os.path.getmtime(dataFileName)
+    return summary["end"] <= os.path.getsize(dataFileName)
+
+# read the index of a data file, returns (summary, device map, entries)
+# an empty index is returned if there isn't one or it doesn't match the data file
+def readIndex(dataFileName):
+    try:
+        with open(dataFileName+idxSuffix) as idxFile:
+            summary = json.loads(idxFile.readline())
+            if indexCurrent(dataFileName, summary):
+                return (summary, json.loads(idxFile.readline()), [json.loads(line) for line in idxFile])
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+    return ({"end": 0, "first": 2**62, "last": 0, "entries": 0}, {}, [])
+
+# replace the index of a data file
+def writeIndex(dataFileName, summary, idMap, entries):
+    idxFileName = dataFileName+idxSuffix
+    with open(idxFileName+".tmp", "w") as idxFile:
+        idxFile.write(json.dumps(summary, sort_keys=True)+"\n")
+        idxFile.write(json.dumps(idMap, sort_keys=True)+"\n")
+        for entry in entries:
+            idxFile.write(json.dumps(entry)+"\n")
+    os.rename(idxFileName+".tmp", idxFileName)
+
+# index the complete lines of a data file that haven't been indexed yet
+def updateIndex(dataFileName):
+    (summary, idMap, entries) = readIndex(dataFileName)
+    offset = summary["end"]
+    if compressMethod(dataFileName) != "":
+        if offset > 0:
+            return 0
+    elif (offset >= os.path.getsize(dataFileName)) and os.path.exists(dataFileName+idxSuffix):
+        return 0
+    nEntries = 0
+    dataFile = openCompressed(dataFileName)
+    with dataFile:
+        if offset:
+            dataFile.seek(offset)
+        for line in dataFile:
+            if not line.endswith("\n"):     # partial line that is still being written
+                break
+            if line.strip() != "":
+                (entry, ids) = indexLine(offset, line)
+                entries.append(entry)
+                for seId in ids:
+                    idMap.setdefault(seId, []).append(entry)
+                summary["first"] = min(summary["first"], entry[2])
+                summary["last"] = max(summary["last"], entry[3])
+                nEntries += 1
+            offset += len(line)
+    summary["end"] = offset
+    summary["entries"] = len(entries)
+    writeIndex(dataFileName, summary, idMap, entries)
+    return nEntries
+
+# return True if an entry is in the time range of the query
+def entryInRange(entry):
+    return (entry[3] >= startTime) and (entry[2] < endTime)
+
+# return the indexed entries of a data file that match the query and the end of the index
+# only the parts of the index that are needed are read
+def queryIndex(dataFileName):
+    try:
+        with open(dataFileName+idxSuffix) as idxFile:
+            summary = json.loads(idxFile.readline())
+            if not indexCurrent(dataFileName, summary):
+                return ([], 0)
+            if (summary["last"] < startTime) or (summary["first"] >= endTime):
+                return ([], summary["end"])
+            idMapLine = idxFile.readline()
+            if seIds:
+                idMap = json.loads(idMapLine)
+                entries = sorted(set(tuple(entry) for seId in seIds for entry in idMap.get(seId, [])))
+            else:
+                entries = [json.loads(line) for line in idxFile]
+            return ([entry for entry in entries if entryInRange(entry)], summary["end"])
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return ([], 0)
+
+# write a line of data that matches the query
+def writeLine(line, outFile):
+    if wholeLines or not seIds:
+        outFile.write(line)
+    else:
+        # only include the requested devices
+        msgDict = json.loads(line)
+        for devType in ["inverters", "optimizers", "events"]:
+            if devType in msgDict:
+                msgDict[devType] = dict((seId, devDict) for (seId, devDict) in msgDict[devType].items()
+                                        if seId in seIds)
+        outFile.write(json.dumps(msgDict)+"\n")
+
+# write the lines of a data file that match the query
+# the index isn't updated, lines after the end of the index are read from the data file
+def queryFile(dataFileName, outFile):
+    (entries, end) = queryIndex(dataFileName)
+    compressed = compressMethod(dataFileName) != ""
+    if compressed and end and not entries:
+        # a compressed file isn't appended to, so the current index covers all of it
+        return
+    pos = 0
+    dataFile = openCompressed(dataFileName)
+    with dataFile:
+        for (offset, length, first, last) in entries + [(end, 0, 0, 0)]:
+            if compressed:
+                # compressed files can only be read forward
+                while pos < offset:
+                    skipped = dataFile.read(min(offset - pos, decompressBufSize))
+                    if skipped == "":
+                        break
+                    pos += len(skipped)
+            else:
+                dataFile.seek(offset)
+            line = dataFile.read(length)
+            pos = offset + length
+            if line != "":
+                writeLine(line, outFile)
+        # lines that haven't been indexed
+        for line in dataFile:
+            if not line.endswith("\n"):     # partial line that is still being written
+                break
+            if line.strip() != "":
+                (entry, ids) = indexLine(pos, line)
+                if entryInRange(entry) and ((not seIds) or not seIds.isdisjoint(ids)):
+                    writeLine(line, outFile)
+            pos += len(line)
+
+if __name__ == "__main__":
+    # get program arguments and options
+    (opts, args) = getopt.getopt(sys.argv[1:], "d:e:flqs:u")
+    for opt in opts:
+        if opt[0] == "-d":
+            seIds = set(seId.upper() for seId in opt[1].split(","))
+        elif opt[0] == "-e":
+            endTime = parseTime(opt[1])
+        elif opt[0] == "-f":
+            following = True
+        elif opt[0] == "-l":
+            wholeLines = True
+        elif opt[0] == "-q":
+            query = True
+        elif opt[0] == "-s":
+            startTime = parseTime(opt[1])
+        elif opt[0] == "-u":
+            update = True
+    if args == []:
+        print "Data file or directory must be specified"
+        sys.exit(1)
+    if query == update:
+        print "Either -q or -u must be specified"
+        sys.exit(1)
+    if query:
+        for dataFileName in listDataFiles(args):
+            queryFile(dataFileName, sys.stdout)
+    else:
+        while True:
+            for dataFileName in listDataFiles(args):
+                updateIndex(dataFileName)
+            if not following:
+                break
+            time.sleep(sleepInterval)
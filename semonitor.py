@@ -4,11 +4,16 @@
 
 import time
 import threading
+import signal
 from seConf import *
 from seFiles import *
 from seMsg import *
 from seData import *
 from seCommands import *
+from seDedup import *
+from seReorder import *
+from seMetrics import *
+from seMemory import *
 
 # global variables
 threadLock = threading.Lock()       # lock to synchronize reads and writes
@@ -17,6 +22,9 @@ running = True
 dataInSeq = 0
 dataOutSeq = 0
 outSeq = 0
+dedupFilter = None
+reorderBuffer = None
+reorderCheckInterval = 1
 
 # process the input data
 def readData(dataFile, recFile, outFile):
@@ -26,12 +34,19 @@ def readData(dataFile, recFile, outFile):
     if passiveMode:
         (msg, dataInSeq) = readMsg(dataFile, dataInSeq, recFile)   # skip data until the start of the first complete message
     while running:
+        checkProfile()
+        checkStages()
+        for line in checkMemory(evictDevices):
+            log(line)
+        if passiveMode:     # otherwise the main thread checks the catalogue
+            checkCatalog()
         (msg, dataInSeq) = readMsg(dataFile, dataInSeq, recFile)
         if msg == "":   # end of file
             # eof from network means connection was broken, wait for a reconnect and continue
             if networkDevice:
                 closeData(dataFile)
                 dataFile = openDataSocket()
+                countMetric("reconnects_total")
             else: # all finished
                 if updateFileName != "":    # write the firmware update file
                     writeUpdate()
@@ -39,24 +54,41 @@ def readData(dataFile, recFile, outFile):
         if msg == "\x00"*len(msg):   # ignore messages containing all zeros
             if debugData: logData(msg)
         else:
+            recvTime = time.time()
             with threadLock:
                 try:
-                    processMsg(msg, dataFile, recFile, outFile)
+                    processMsg(msg, dataFile, recFile, outFile, recvTime)
                 except Exception as ex:
+                    countMetric("exceptions_total")
                     debug("debugEnable", "Exception:", ex.args[0])
                     if haltOnException:
                         logData(msg)
                         raise
 
+# request the stage times and a memory report, they are logged when the next message is read
+def logStatus(signum, frame):
+    requestStages()
+    requestMemory()
+
 # process a received message
-def processMsg(msg, dataFile, recFile, outFile):
+def processMsg(msg, dataFile, recFile, outFile, recvTime):
     global dataInSeq, dataOutSeq, outSeq
     # parse the message
     (msgSeq, fromAddr, toAddr, function, data) = parseMsg(msg)
-    msgData = parseData(function, data)                    
+    decodeStart = time.time()
+    msgData = parseData(function, data)
+    observeMetric("stage_seconds", time.time() - decodeStart, stageDecode)
     if (function == PROT_CMD_SERVER_POST_DATA) and (data != ""):    # performance data
-        # write performance data to output files
-        outSeq = writeData(msgData, outFile, outSeq)
+        devicesSeen(msgData, recvTime)
+        if pcapInput:   # time the message was captured
+            msgData["time"] = round(dataFile.recvTime, 6)
+        # write performance data to output files unless it has all been seen before
+        if (not dedupFilter) or dedupFilter.filterMsg(msgData):
+            if reorderBuffer:
+                for reorderedData in reorderBuffer.add(msgData):
+                    outSeq = writeData(reorderedData, outFile, outSeq)
+            else:
+                outSeq = writeData(msgData, outFile, outSeq)
     elif (updateFileName != "") and function == PROT_CMD_UPGRADE_WRITE:    # firmware update data
         updateBuf[msgData["offset"]:msgData["offset"]+msgData["length"]] = msgData["data"]
     if (networkDevice or masterMode):    # send reply
@@ -74,6 +106,7 @@ def processMsg(msg, dataFile, recFile, outFile):
         if replyFunction != "":
             msg = formatMsg(msgSeq, toAddr, fromAddr, replyFunction, replyData)
             dataOutSeq = sendMsg(dataFile, msg, dataOutSeq, recFile)
+            observeMetric("ack_seconds", time.time() - recvTime)
 
 # write firmware image to file
 def writeUpdate():
@@ -87,14 +120,41 @@ def masterCommands(dataFile, recFile):
     global dataOutSeq
     while running:
         for slaveAddr in slaveAddrs:
+            masterEvent.clear()
             with threadLock:
                 # grant control of the bus to the slave
                 dataOutSeq = sendMsg(dataFile, formatMsg(nextSeq(), masterAddr, int(slaveAddr, 16), PROT_CMD_POLESTAR_MASTER_GRANT), dataOutSeq, recFile)
-            # wait for slave to release the bus
-            masterEvent.clear()
-            masterEvent.wait()
+            # wait for slave to release the bus, a slave that doesn't respond loses the grant
+            if not masterEvent.wait(masterGrantTimeout):
+                log("No response from slave", slaveAddr)
         time.sleep(masterMsgInterval)
 
+# write the records held in the reorder buffer that are ready, or all of them
+def releaseReorder(outFile, flush=True):
+    global outSeq
+    with threadLock:
+        for reorderedData in reorderBuffer.release(flush):
+            outSeq = writeData(reorderedData, outFile, outSeq)
+
+# reorder thread, writes records that have been held too long while no data is arriving
+def reorderTimer(outFile):
+    while running:
+        time.sleep(reorderCheckInterval)
+        releaseReorder(outFile, False)
+
+# write the data that is being held and save the catalogue before terminating
+def finish(outFile):
+    if reorderBuffer:
+        releaseReorder(outFile)
+        if reorderBuffer.late:
+            log("late records:", reorderBuffer.late)
+    logCatalog()
+    saveCatalog()
+
+# terminate in the same way as for a keyboard interrupt so that held data is written
+def terminateSignal(signum, frame):
+    raise KeyboardInterrupt
+
 # perform the specified commands
 def doCommands(dataFile, commands, recFile):
     global dataInSeq, dataOutSeq, outSeq
@@ -116,11 +176,32 @@ def doCommands(dataFile, commands, recFile):
 
 if __name__ == "__main__":
     # initialization
+    if dedupMemory != 0:
+        dedupFilter = DedupFilter(dedupMemory)
+    if reorderSecs or reorderRecords:
+        reorderBuffer = ReorderBuffer(reorderSecs, reorderRecords)
+    loadCatalog()
+    if metricsPort:
+        startMetrics(metricsAddr, metricsPort)
+    if memDiagnostics:
+        startMemory(memReportInterval, memCapSize)
+    signal.signal(signal.SIGUSR1, logStatus)
+    if profileFileName != "":
+        signal.signal(signal.SIGUSR2, toggleProfile)
+    signal.signal(signal.SIGTERM, terminateSignal)
     dataFile = openData(inFileName)
     (recFile, outFile) = openOutFiles(recFileName, outFileName)
+    if reorderBuffer:
+        reorderThread = threading.Thread(name=reorderThreadName, target=reorderTimer, args=(outFile,))
+        reorderThread.daemon = True
+        reorderThread.start()
     if passiveMode: # only reading from file or serial device
         # read until eof then terminate
-        readData(dataFile, recFile, outFile)
+        try:
+            readData(dataFile, recFile, outFile)
+        except KeyboardInterrupt:
+            pass
+        running = False
     else:   # reading and writing to network or serial device
         if commandAction:   # commands were specified
             # perform commands then terminate
@@ -136,8 +217,13 @@ if __name__ == "__main__":
                 masterThread.start()
                 debug("debugFiles", "starting", masterThreadName)
             # wait for termination
-            running = waitForEnd()
+            running = waitForEnd(lambda: finish(outFile), checkCatalog)
     # cleanup
+    finish(outFile)
+    if dedupFilter:
+        dedupFilter.logStats()
+    if debugFiles:
+        logStages()
     closeData(dataFile)
     closeOutFiles(recFile, outFile)
     
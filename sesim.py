@@ -0,0 +1,282 @@
+#!/usr/bin/python
+
+# Simulate SolarEdge inverters that send data to a monitoring server
+#
+# Each simulated inverter connects to the server, sends performance data posts generated
+# by seSynth, and waits for the server to acknowledge each one.  Inverters can also send
+# time requests and encrypted messages, reconnect periodically, send a backlog of posts
+# in a burst when they connect, or replay the messages in a recording.  When all of the
+# inverters have finished the acknowledgement latency percentiles and the numbers of
+# posts that were dropped are reported.
+
+import collections
+import getopt
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+# seConf parses the program arguments when it is imported
+simArgs = sys.argv[1:]
+sys.argv = sys.argv[:1]
+
+from seSynth import *
+from seData import *
+
+# parameters
+serverHost = "localhost"
+serverPort = sePort
+nInverters = 1
+nOptimizers = 20
+nPosts = 10
+postInterval = 1.0
+ackTimeout = 10.0
+gmtInterval = 0             # send a time request every n posts
+encInterval = 0             # send an encrypted message every n posts
+reconnectInterval = 0       # reconnect every n posts
+burstPosts = 0              # backlog posts sent when connecting
+replayFileName = ""
+reconnectDelay = 1.0
+connectAttempts = 10
+dataInterval = 300          # time between device data samples
+encMsgLen = 64
+recvSize = 4096
+
+# functions that are sent by inverters in a replayed recording
+replayFunctions = [PROT_CMD_SERVER_POST_DATA, PROT_CMD_SERVER_GET_GMT, 0x0503]
+
+# results
+stats = collections.Counter()
+latencies = []
+statsLock = threading.Lock()
+
+def count(name, n=1):
+    with statsLock:
+        stats[name] += n
+
+# read the messages in a recording and return the ones that are sent by inverters
+def readRecording(fileName):
+    with open(fileName, "rb") as recFile:
+        recData = recFile.read()
+    msgs = []
+    for frame in recData.split(magic)[1:]:
+        try:
+            (msgSeq, fromAddr, toAddr, function, data) = parseMsg(frame)
+        except Exception:
+            continue
+        if function in replayFunctions:
+            msgs.append((msgSeq, fromAddr, toAddr, function, data))
+    return msgs
+
+class ServerUnavailable(Exception):
+    pass
+
+# a simulated inverter
+class Inverter(threading.Thread):
+
+    def __init__(self, idx, replayMsgs):
+        threading.Thread.__init__(self, name="inverter %d" % idx)
+        self.site = Site(1, nOptimizers, idx, invBaseId + idx, optBaseId + idx*nOptimizers)
+        self.seId = self.site.inverters[0]
+        self.replayMsgs = replayMsgs
+        self.sock = None
+        self.inBuf = ""
+        self.msgSeq = random.Random(idx).randint(0, 0xffff)
+
+    def connect(self):
+        for attempt in range(connectAttempts):
+            try:
+                self.sock = socket.create_connection((serverHost, serverPort), ackTimeout)
+                self.inBuf = ""
+                count("connections")
+                return
+            except socket.error:
+                count("connectErrors")
+                time.sleep(reconnectDelay)
+        raise ServerUnavailable()
+
+    def disconnect(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def reconnect(self):
+        self.disconnect()
+        count("reconnects")
+        self.connect()
+
+    # return the next complete message from the server, or None if it isn't received by the deadline
+    def recvMsg(self, deadline):
+        while True:
+            start = self.inBuf.find(magic)
+            if start >= 0:
+                self.inBuf = self.inBuf[start:]
+                if len(self.inBuf) >= magicLen+msgHdrLen:
+                    dataLen = struct.unpack("<H", self.inBuf[magicLen:magicLen+2])[0]
+                    msgLen = magicLen+msgHdrLen+dataLen+checksumLen
+                    if len(self.inBuf) >= msgLen:
+                        msg = self.inBuf[magicLen:msgLen]
+                        self.inBuf = self.inBuf[msgLen:]
+                        try:
+                            return parseMsg(msg)
+                        except Exception:
+                            count("badResponses")
+                            continue
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                return None
+            self.sock.settimeout(timeout)
+            try:
+                data = self.sock.recv(recvSize)
+            except socket.timeout:
+                return None
+            if data == "":
+                raise socket.error("connection closed")
+            self.inBuf += data
+
+    # send a message and wait for the response, returns False if it wasn't received
+    def request(self, function, data, respFunction=None, msgSeq=None, fromAddr=None, toAddr=serverAddr):
+        if msgSeq is None:
+            self.msgSeq = (self.msgSeq + 1) & 0xffff
+            msgSeq = self.msgSeq
+        if fromAddr is None:
+            fromAddr = self.seId
+        sendTime = time.time()
+        try:
+            self.sock.sendall(formatMsg(msgSeq, fromAddr, toAddr, function, data))
+            if respFunction is None:
+                return True
+            while True:
+                response = self.recvMsg(sendTime + ackTimeout)
+                if response is None:
+                    count("timeouts")
+                    return False
+                if (response[0] == msgSeq) and (response[3] == respFunction):
+                    with statsLock:
+                        latencies.append(time.time() - sendTime)
+                    return True
+                count("unexpectedResponses")
+        except socket.error:
+            count("connectionErrors")
+            self.reconnect()
+            return False
+
+    # send a post and wait for the acknowledgement
+    def post(self, data):
+        count("posts")
+        if self.request(PROT_CMD_SERVER_POST_DATA, data, PROT_RESP_ACK):
+            count("acked")
+        else:
+            count("dropped")
+
+    # send the posts of a time
+    def postTime(self, timeStamp):
+        for (inverter, data, nDevices) in self.site.posts(int(timeStamp), dataInterval):
+            self.post(data)
+            count("devices", nDevices)
+
+    def replay(self):
+        for (msgSeq, fromAddr, toAddr, function, data) in self.replayMsgs:
+            if function == PROT_CMD_SERVER_POST_DATA:
+                count("posts")
+                if self.request(function, data, PROT_RESP_ACK, msgSeq, fromAddr, toAddr):
+                    count("acked")
+                else:
+                    count("dropped")
+            elif function == PROT_CMD_SERVER_GET_GMT:
+                count("gmtRequests")
+                self.request(function, data, PROT_RESP_SERVER_GMT, msgSeq, fromAddr, toAddr)
+            else:
+                count("encrypted")
+                self.request(function, data, None, msgSeq, fromAddr, toAddr)
+            time.sleep(postInterval)
+
+    def run(self):
+        try:
+            self.connect()
+            self.simulate()
+        except ServerUnavailable:
+            count("abandoned")
+        self.disconnect()
+
+    def simulate(self):
+        if self.replayMsgs:
+            self.replay()
+        else:
+            # send the posts that were buffered while the inverter was disconnected
+            now = time.time()
+            for i in range(burstPosts, 0, -1):
+                self.postTime(now - i*dataInterval)
+            for i in range(nPosts):
+                if reconnectInterval and i and (i % reconnectInterval == 0):
+                    self.reconnect()
+                if gmtInterval and (i % gmtInterval == 0):
+                    count("gmtRequests")
+                    self.request(PROT_CMD_SERVER_GET_GMT, "", PROT_RESP_SERVER_GMT)
+                if encInterval and (i % encInterval == 0):
+                    # the content of encrypted messages isn't interpreted
+                    count("encrypted")
+                    self.request(0x0503, os.urandom(encMsgLen))
+                self.postTime(time.time())
+                time.sleep(postInterval)
+
+# return the value at a percentile of a sorted list
+def percentile(values, pct):
+    return values[min(len(values)-1, int(len(values) * pct / 100.0))]
+
+# print the results
+def report(elapsed):
+    print "%-21s" % "inverters:", nInverters
+    print "%-21s" % "elapsed secs:", "%.1f" % elapsed
+    for name in ["connections", "reconnects", "connectErrors", "connectionErrors", "posts", "acked",
+                 "dropped", "timeouts", "devices", "gmtRequests", "encrypted",
+                 "unexpectedResponses", "badResponses", "abandoned"]:
+        print "%-21s" % (name+":"), stats[name]
+    if latencies:
+        values = sorted(latencies)
+        print "latency ms:           p50 %.1f p90 %.1f p99 %.1f max %.1f" % tuple(1000 * v for v in
+            [percentile(values, 50), percentile(values, 90), percentile(values, 99), values[-1]])
+
+if __name__ == "__main__":
+    # get program arguments and options
+    (opts, args) = getopt.getopt(simArgs, "b:c:e:g:i:n:o:p:r:t:")
+    for opt in opts:
+        if opt[0] == "-b":
+            burstPosts = int(opt[1])
+        elif opt[0] == "-c":
+            nPosts = int(opt[1])
+        elif opt[0] == "-e":
+            encInterval = int(opt[1])
+        elif opt[0] == "-g":
+            gmtInterval = int(opt[1])
+        elif opt[0] == "-i":
+            postInterval = float(opt[1])
+        elif opt[0] == "-n":
+            nInverters = int(opt[1])
+        elif opt[0] == "-o":
+            nOptimizers = int(opt[1])
+        elif opt[0] == "-p":
+            replayFileName = opt[1]
+        elif opt[0] == "-r":
+            reconnectInterval = int(opt[1])
+        elif opt[0] == "-t":
+            ackTimeout = float(opt[1])
+    if args:
+        server = args[0].split(":")
+        serverHost = server[0]
+        if len(server) > 1:
+            serverPort = int(server[1])
+    replayMsgs = readRecording(replayFileName) if replayFileName != "" else []
+    inverters = [Inverter(i, replayMsgs) for i in range(nInverters)]
+    startTime = time.time()
+    for inverter in inverters:
+        inverter.daemon = True
+        inverter.start()
+    try:
+        while any(inverter.is_alive() for inverter in inverters):
+            time.sleep(.1)
+    except KeyboardInterrupt:
+        pass
+    report(time.time() - startTime)